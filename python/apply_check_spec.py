@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from pagination import PageFanOut
+from rate_limit import DEFAULT_RATES
+from uptime_api import UptimeAPI
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+CONFIG = {
+    'api': 'https://uptime.com/api/v1/',
+    'client': None,
+    'workers': 8,
+    # Times the checks are listed when they change while being read.
+    'listing_attempts': 3,
+}
+
+# List fields that are replaced through their own endpoint rather than a PATCH.
+REPLACE_ENDPOINTS = {
+    'tags': 'checks/{pk}/replace-tags/',
+    'locations': 'checks/{pk}/replace-locations/',
+    'contact_groups': 'checks/{pk}/replace-contact-groups/',
+}
+
+# Fields that identify a check and are never updated.
+KEY_FIELDS = ('name', 'check_type')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Create or update checks to match a YAML '
+                                                 'or JSON spec, changing only what differs.')
+    parser.add_argument('--token', required=True,
+                        help='Your Uptime.com API Token')
+    parser.add_argument('--api',
+                        help='(optional) The Uptime.com API endpoint to use, eg. '
+                             'https://uptime.com/api/v1/')
+    parser.add_argument('spec',
+                        help='A YAML or JSON file with a "checks" list; each check has a '
+                             'unique "name", a "check_type" and the fields to set on it')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='(optional) Print the changes without making them')
+    parser.add_argument('--workers', type=int, default=CONFIG['workers'],
+                        help='(optional) Number of API calls to make at once, default {}'.format(
+                            CONFIG['workers']))
+    parser.add_argument('--read-rate', type=float,
+                        help='(optional) Read requests per second to allow, default {:g} at '
+                             'first, rising to {:g} while the API keeps up. Raise it to let '
+                             'pages load concurrently'.format(DEFAULT_RATES['read'][0],
+                                                              DEFAULT_RATES['read'][2]))
+
+    return parser.parse_args()
+
+
+def load_spec(path):
+    """Read the list of checks from a YAML or JSON file."""
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            if yaml is None:
+                sys.exit('PyYAML is required to read {}; install it or use JSON.'.format(path))
+            spec = yaml.safe_load(f)
+        else:
+            spec = json.load(f)
+
+    checks = spec['checks'] if isinstance(spec, dict) else spec
+    names = [c['name'] for c in checks]
+    duplicates = sorted({n for n in names if names.count(n) > 1})
+    if duplicates:
+        sys.exit('Check names must be unique in the spec: {}'.format(', '.join(duplicates)))
+    return checks
+
+
+def load_checks_page(page, page_size):
+    return CONFIG['client'].call('get', 'checks/',
+                                 params={'page': page, 'page_size': page_size},
+                                 label='Loading checks (page {})'.format(page))
+
+
+def load_all_checks():
+    """Load all checks in the account, spanning multiple pages of results if necessary.
+
+    Pages are loaded `workers` at a time. A check missed because checks were added or
+    removed meanwhile would be created again, so the listing is read until it is stable.
+    """
+    page_size = CONFIG['client'].page_size('checks/')
+    for _ in range(CONFIG['listing_attempts']):
+        pages = PageFanOut(lambda page: load_checks_page(page, page_size), page_size,
+                           CONFIG['workers'])
+        all_checks = {}
+        for r in pages:
+            all_checks.update((c['pk'], c) for c in r['results'])
+        if not pages.shifted and len(all_checks) == pages.count:
+            return list(all_checks.values())
+        print('Checks were added or removed while loading them, reading them again...')
+
+    sys.exit('Checks kept changing while they were loaded; try again later.')
+
+
+def same_value(wanted, current):
+    if isinstance(wanted, list) and isinstance(current, list):
+        return sorted(map(str, wanted)) == sorted(map(str, current))
+    return wanted == current or str(wanted) == str(current)
+
+
+def add_endpoint(check_type):
+    return 'checks/add-{}/'.format(check_type.lower().replace('_', '-'))
+
+
+def plan_changes(spec, existing):
+    """Compare the spec with the existing checks and return the API calls needed, as
+    (description, method, endpoint, pk, payload) tuples, and the number of spec entries
+    skipped because they cannot be applied."""
+    by_name = {}
+    for check in existing:
+        by_name.setdefault(check['name'], []).append(check)
+
+    calls = []
+    skipped = 0
+    for wanted in spec:
+        matches = by_name.get(wanted['name'], [])
+        if len(matches) > 1:
+            print('SKIP - {}: {} checks have this name'.format(wanted['name'], len(matches)))
+            skipped += 1
+            continue
+        if not matches:
+            payload = {k: v for k, v in wanted.items() if k != 'check_type'}
+            calls.append(('CREATE - ' + wanted['name'], 'post',
+                          add_endpoint(wanted['check_type']), None, payload))
+            continue
+
+        current = matches[0]
+        if current['check_type'] != wanted['check_type']:
+            print('SKIP - {}: check type is {}, not {}'.format(
+                wanted['name'], current['check_type'], wanted['check_type']))
+            skipped += 1
+            continue
+
+        patch = {}
+        for field, value in wanted.items():
+            if field in KEY_FIELDS or same_value(value, current.get(field)):
+                continue
+            if field in REPLACE_ENDPOINTS:
+                calls.append(('REPLACE {} - {}'.format(field, wanted['name']), 'patch',
+                              REPLACE_ENDPOINTS[field], current['pk'], {field: value}))
+            else:
+                patch[field] = value
+        if patch:
+            calls.append(('UPDATE {} - {}'.format(', '.join(sorted(patch)), wanted['name']),
+                          'patch', 'checks/{pk}/', current['pk'], patch))
+    return calls, skipped
+
+
+def find_check(name):
+    """Return the check with exactly this name, or None."""
+    r = CONFIG['client'].call('get', 'checks/', params={'search': name})
+    return next((c for c in r['results'] if c['name'] == name), None)
+
+
+def make_call(call):
+    description, method, endpoint, pk, payload = call
+    if method == 'post':
+        # A create that failed with a 5xx may still have created the check, so look for
+        # it before trying again rather than creating it twice.
+        CONFIG['client'].call(method, endpoint, pk=pk, json=payload, label=description,
+                              recover=lambda: find_check(payload['name']))
+    else:
+        # Setting the same fields again is harmless.
+        CONFIG['client'].call(method, endpoint, pk=pk, json=payload, label=description,
+                              idempotent=True)
+
+
+def main():
+    """Program entry point."""
+    opts = parse_args()
+    CONFIG['api'] = opts.api or CONFIG['api']
+    CONFIG['workers'] = max(1, opts.workers)
+    CONFIG['client'] = UptimeAPI(opts.token, CONFIG['api'], log_file=sys.stdout,
+                                 pool_size=CONFIG['workers'],
+                                 rate_limits={'read': opts.read_rate} if opts.read_rate else None)
+
+    spec = load_spec(opts.spec)
+    calls, skipped = plan_changes(spec, load_all_checks())
+    if not calls:
+        if skipped:
+            sys.exit('{} checks already match the spec, {} skipped.'.format(
+                len(spec) - skipped, skipped))
+        print('All {} checks already match the spec.'.format(len(spec)))
+        return
+
+    if opts.dry_run:
+        for description, method, endpoint, pk, payload in calls:
+            print('{}: {} {} {}'.format(description, method.upper(),
+                                        endpoint.format(pk=pk), json.dumps(payload)))
+        if skipped:
+            sys.exit('{} spec entries skipped.'.format(skipped))
+        return
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=CONFIG['workers']) as pool:
+        futures = [(call, pool.submit(make_call, call)) for call in calls]
+        for call, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                failed += 1
+                print('FAILED - {}: {}'.format(call[0], e))
+
+    print('\n{} API calls made for {} checks, {} failed, {} skipped.'.format(
+        len(calls), len(spec), failed, skipped))
+    if failed or skipped:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+import argparse
+import contextlib
+import gc
+import io
+import random
+import time
+import tracemalloc
+
+from monitor_checks_and_alerts import (DownIndex, check_state, display_check_status,
+                                       merge_alerts_into_check_status)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure the memory used by the monitor's "
+                                                 "check state and the cost of updating it.")
+    parser.add_argument('--sizes', default='100000,1000000',
+                        help='(optional) Comma separated numbers of synthetic checks to test, '
+                             'default 100000,1000000')
+    parser.add_argument('--alerts', type=int, default=1000,
+                        help='(optional) Number of alerts to merge per run, default 1000')
+
+    return parser.parse_args()
+
+
+def synthetic_checks(count, seed=0):
+    """Yield check records shaped like the checks/ API results."""
+    rnd = random.Random(seed)
+    for pk in range(1, count + 1):
+        yield {
+            'pk': pk,
+            'name': 'Check {:07d}'.format(pk),
+            'is_paused': rnd.random() < 0.05,
+            'state_is_up': rnd.random() > 0.01,
+            'state_changed_at': '2020-{:02d}-{:02d}T{:02d}:{:02d}:00Z'.format(
+                rnd.randint(1, 12), rnd.randint(1, 28), rnd.randint(0, 23), rnd.randint(0, 59)),
+        }
+
+
+def dict_state(c):
+    """The five-key dict the monitor used to keep for each check."""
+    return {
+        'pk': c['pk'],
+        'name': c['name'],
+        'is_paused': c['is_paused'],
+        'state_is_up': c['state_is_up'],
+        'state_changed_at': c['state_changed_at'],
+    }
+
+
+def measure_memory(count, build):
+    """Return the bytes held by a {pk: state} dict of `count` checks built with `build`."""
+    gc.collect()
+    tracemalloc.start()
+    checks = {c['pk']: build(c) for c in synthetic_checks(count)}
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del checks
+    return current
+
+
+def measure_updates(count, alerts):
+    """Time building the down index, merging alerts and rendering the status view."""
+    checks = {c['pk']: check_state(c) for c in synthetic_checks(count)}
+    down_index = DownIndex()
+
+    started = time.perf_counter()
+    for check in checks.values():
+        down_index.update(check)
+    indexed = time.perf_counter() - started
+
+    rnd = random.Random(1)
+    new_alerts = [{'check_pk': rnd.randint(1, count), 'state_is_up': rnd.random() > 0.5,
+                   'state_changed_at': 1600000000 + i} for i in range(alerts)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        merge_alerts_into_check_status(checks, new_alerts, down_index)
+        merged = time.perf_counter() - started
+
+        started = time.perf_counter()
+        display_check_status(checks, down_index)
+        displayed = time.perf_counter() - started
+
+    return indexed, merged, displayed, len(down_index)
+
+
+def main():
+    """Program entry point."""
+    opts = parse_args()
+    print('{:>9} {:>12} {:>12} {:>7} {:>10} {:>12} {:>10} {:>6}'.format(
+        'checks', 'dict MB', 'slots MB', 'saved', 'index s', 'merge us/al', 'display ms', 'down'))
+    for count in (int(n) for n in opts.sizes.split(',')):
+        dict_bytes = measure_memory(count, dict_state)
+        slots_bytes = measure_memory(count, check_state)
+        indexed, merged, displayed, down = measure_updates(count, opts.alerts)
+        print('{:>9} {:>12.1f} {:>12.1f} {:>6.0f}% {:>10.2f} {:>12.1f} {:>10.2f} {:>6}'.format(
+            count, dict_bytes / 2 ** 20, slots_bytes / 2 ** 20,
+            100 * (1 - slots_bytes / dict_bytes), indexed, merged / opts.alerts * 1e6,
+            displayed * 1000, down))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import random
+import time
+
+from json_decoders import DECODERS, project
+from monitor_checks_and_alerts import CHECK_FIELDS
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Time decoding a page of checks with each '
+                                                 'installed JSON library.')
+    parser.add_argument('--page-size', type=int, default=250,
+                        help='(optional) Number of checks in the page, default 250')
+    parser.add_argument('--repeat', type=int, default=200,
+                        help='(optional) Number of times to decode the page, default 200')
+
+    return parser.parse_args()
+
+
+def synthetic_page(count, seed=0):
+    """Return the body of a checks/ page, with items shaped like the real API results."""
+    rnd = random.Random(seed)
+    results = []
+    for pk in range(1, count + 1):
+        results.append({
+            'pk': pk,
+            'url': 'https://uptime.com/api/v1/checks/{}/'.format(pk),
+            'name': 'Check {:07d}'.format(pk),
+            'cached_response_time': rnd.random() * 1000,
+            'contact_groups': ['Default', 'Ops'],
+            'created_at': '2020-01-01T00:00:00Z',
+            'modified_at': '2020-06-01T00:00:00Z',
+            'locations': ['US-East', 'US-West', 'GBR', 'AUT', 'DEU'],
+            'tags': ['production', 'web'],
+            'check_type': 'HTTP',
+            'escalations': [],
+            'monitoring_service_type': 'HTTP',
+            'is_paused': rnd.random() < 0.05,
+            'state_is_up': rnd.random() > 0.01,
+            'state_changed_at': '2020-05-{:02d}T12:00:00Z'.format(rnd.randint(1, 28)),
+            'msp_protocol': 'http',
+            'msp_interval': 5,
+            'msp_address': 'https://example.com/{}'.format(pk),
+            'msp_port': None,
+            'msp_username': '',
+            'msp_proxy': '',
+            'msp_dns_server': '',
+            'msp_dns_record_type': '',
+            'msp_status_code': '',
+            'msp_send_string': '',
+            'msp_expect_string': '',
+            'msp_expect_string_type': 'STRING',
+            'msp_encryption': '',
+            'msp_threshold': 30,
+            'msp_headers': '',
+            'msp_script': '',
+            'msp_sensitivity': 2,
+            'msp_num_retries': 2,
+            'msp_use_ip_version': '',
+            'msp_uptime_sla': '0.9990',
+            'msp_response_time_sla': '1.000',
+            'msp_notes': 'Synthetic check used for benchmarking the JSON decoders.',
+            'msp_include_in_global_metrics': True,
+            'share_url': '',
+            'stats_url': 'https://uptime.com/api/v1/checks/{}/stats/'.format(pk),
+            'alerts_url': 'https://uptime.com/api/v1/checks/{}/alerts/'.format(pk),
+        })
+    return json.dumps({'count': count, 'next': None, 'previous': None,
+                       'results': results}).encode()
+
+
+def time_decoder(loads, body, repeat, fields=None):
+    """Return the mean seconds taken to decode (and optionally project) the page."""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        res = loads(body)
+        if fields is not None:
+            project(res, fields)
+    return (time.perf_counter() - started) / repeat
+
+
+def main():
+    """Program entry point."""
+    opts = parse_args()
+    body = synthetic_page(opts.page_size)
+    print('{} checks, {:.1f} KB per page\n'.format(opts.page_size, len(body) / 1024))
+    print('{:8s} {:>12} {:>18} {:>10}'.format('decoder', 'decode ms', 'decode+project ms',
+                                              'MB/s'))
+    for name in sorted(DECODERS):
+        decode = time_decoder(DECODERS[name], body, opts.repeat)
+        projected = time_decoder(DECODERS[name], body, opts.repeat, CHECK_FIELDS)
+        print('{:8s} {:>12.2f} {:>18.2f} {:>10.1f}'.format(
+            name, decode * 1000, projected * 1000, len(body) / decode / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main()
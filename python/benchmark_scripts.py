@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+import argparse
+import datetime as dt
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from mock_api_server import start_server
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(SCRIPT_DIR, 'benchmark_baseline.json')
+
+# Metrics where a bigger number is worse; requests_per_sec is the only one where it is better.
+COST_METRICS = ('wall_time', 'requests', 'bytes', 'peak_rss_kb')
+THROUGHPUT_METRICS = ('requests_per_sec',)
+
+
+def scenario_args(name, api, size):
+    """The command line used to run a script against the mock server."""
+    today = dt.datetime.utcnow().date()
+    month_ago = today - dt.timedelta(days=30)
+    common = ['--token', 'benchmark', '--api', api]
+    return {
+        'download_check_stats': [
+            'download_check_stats.py', '-d', str(month_ago), '-f', 'ndjson',
+            '-o', os.devnull] + common,
+        'monitor_checks_and_alerts': [
+            'monitor_checks_and_alerts.py', '--ticks', '5', '--interval', '0'] + common,
+        'bulk_ignore_alerts': [
+            'bulk_ignore_alerts.py', '--from', str(month_ago), '--to', str(today),
+            '--prefix', 'API Sample', '--workers', '4'] + common,
+        'delete_sample_checks': ['delete_sample_checks.py'] + common,
+        'create_and_test_all_checks': [
+            'create_and_test_all_checks.py', '--contacts', 'Default',
+            '--deadline', '0.02'] + common,
+    }[name]
+
+
+SCENARIOS = ('download_check_stats', 'monitor_checks_and_alerts', 'bulk_ignore_alerts',
+             'delete_sample_checks', 'create_and_test_all_checks')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run each script end to end against the mock '
+                                                 'API server and compare with a baseline.')
+    parser.add_argument('--sizes', default='100,1000,10000',
+                        help='(optional) Comma separated account sizes in checks, '
+                             'default 100,1000,10000')
+    parser.add_argument('--scripts', default=','.join(SCENARIOS),
+                        help='(optional) Comma separated scripts to run, default all')
+    parser.add_argument('--latency', type=float, default=20,
+                        help='(optional) Milliseconds of latency added by the mock server, '
+                             'default 20')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                        help='(optional) Baseline JSON file, default benchmark_baseline.json')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='(optional) Save these results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='(optional) Relative change in a metric that counts as a '
+                             'regression, default 0.2 (20%%)')
+    parser.add_argument('--output',
+                        help='(optional) File to write the results to as JSON')
+
+    return parser.parse_args()
+
+
+def run_script(args):
+    """Run a script to completion, returning its wall time, peak RSS and exit status."""
+    with tempfile.TemporaryFile() as log:
+        started = time.perf_counter()
+        # Start each run from the default page sizes rather than ones learned earlier.
+        env = dict(os.environ, UPTIME_PAGE_SIZES='')
+        proc = subprocess.Popen([sys.executable] + args, cwd=SCRIPT_DIR, env=env,
+                                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=log)
+        if hasattr(os, 'wait4'):
+            _, status, usage = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+            peak_rss = usage.ru_maxrss // 1024 if sys.platform == 'darwin' else usage.ru_maxrss
+        else:
+            proc.wait()
+            peak_rss = None
+        wall_time = time.perf_counter() - started
+
+        if proc.returncode != 0:
+            log.seek(0)
+            sys.stderr.write(log.read().decode(errors='replace')[-2000:])
+    return wall_time, peak_rss, proc.returncode
+
+
+def run_scenario(name, size, latency):
+    server = start_server(checks=size, sample_checks=max(1, size // 100),
+                          alerts=max(10, size // 10), outages=size, latency=latency)
+    try:
+        wall_time, peak_rss, returncode = run_script(scenario_args(name, server.api_url, size))
+        counters = dict(server.counters)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    return {
+        'wall_time': round(wall_time, 3),
+        'requests': counters['requests'],
+        'bytes': counters['bytes_in'] + counters['bytes_out'],
+        'requests_per_sec': round(counters['requests'] / wall_time, 2),
+        'peak_rss_kb': peak_rss,
+        'ok': returncode == 0,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Return a list of (key, metric, baseline value, new value) for every regression."""
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        for metric in COST_METRICS + THROUGHPUT_METRICS:
+            old, new = base.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if metric in THROUGHPUT_METRICS:
+                change = -change
+            if change > threshold:
+                regressions.append((key, metric, old, new))
+        if base.get('ok') and not result['ok']:
+            regressions.append((key, 'ok', True, False))
+    return regressions
+
+
+def main():
+    """Program entry point."""
+    opts = parse_args()
+    results = {}
+    print('{:28s} {:>7} {:>9} {:>9} {:>11} {:>9} {:>10}'.format(
+        'script', 'checks', 'wall s', 'requests', 'bytes', 'req/s', 'RSS MB'))
+    for name in opts.scripts.split(','):
+        for size in (int(n) for n in opts.sizes.split(',')):
+            result = run_scenario(name, size, opts.latency)
+            results['{}@{}'.format(name, size)] = result
+            print('{:28s} {:>7} {:>9.2f} {:>9} {:>11} {:>9.1f} {:>10}{}'.format(
+                name, size, result['wall_time'], result['requests'], result['bytes'],
+                result['requests_per_sec'],
+                '{:.1f}'.format(result['peak_rss_kb'] / 1024) if result['peak_rss_kb'] else '-',
+                '' if result['ok'] else '  FAILED'))
+
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+
+    if opts.save_baseline:
+        with open(opts.baseline, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+        print('\nSaved baseline to {}'.format(opts.baseline))
+        return
+
+    if not os.path.exists(opts.baseline):
+        print('\nNo baseline at {}; run with --save-baseline to create one.'.format(opts.baseline))
+        return
+
+    with open(opts.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, opts.threshold)
+    if not regressions:
+        print('\nNo regressions beyond {:.0%} against {}.'.format(opts.threshold, opts.baseline))
+        return
+
+    print('\nREGRESSIONS beyond {:.0%}:'.format(opts.threshold))
+    for key, metric, old, new in regressions:
+        print('  {:36s} {:18s} {} -> {}'.format(key, metric, old, new))
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
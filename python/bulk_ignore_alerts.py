@@ -2,9 +2,14 @@
 import argparse
 import datetime as dt
 import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 import requests
 
+from journal import Journal
+from uptime_api import APIError, UptimeAPI
+
 
 def date(d):
     return dt.datetime.strptime(d, '%Y-%m-%d').date()
@@ -26,14 +31,31 @@ def parse_args():
                         help='The check name or check name prefix to ignore alerts for.')
     parser.add_argument('--subaccount', type=int,
                         help='(optional) A subaccount to process instead of the main account.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='(optional) Number of alerts to ignore concurrently, default 1. '
+                             'Requests are still kept within the API rate limits.')
+    parser.add_argument('--journal', default='bulk_ignore_alerts.journal',
+                        help='(optional) File to record progress in, default '
+                             'bulk_ignore_alerts.journal')
+    parser.add_argument('--resume', action='store_true',
+                        help='(optional) Carry on from where an interrupted run with the same '
+                             'options stopped, as recorded in the journal')
 
     return parser.parse_args()
 
 
 opts = parse_args()
-headers = {'Authorization': 'token ' + opts.token}
-if opts.subaccount:
-    headers['X-Subaccount'] = str(opts.subaccount)
+# One connection per worker, plus one for prefetching the next page of outages.
+api = UptimeAPI(opts.token, opts.api, subaccount=opts.subaccount, pool_size=opts.workers + 1)
+params = {
+    'from': str(getattr(opts, 'from')),
+    'to': str(opts.to),
+    'prefix': opts.prefix,
+    'subaccount': opts.subaccount,
+}
+journal = Journal(opts.journal, params, resume=opts.resume)
+# Fixed for the whole run, and for any resumed runs, so that page numbers keep lining up.
+page_size = journal.remember('page_size', api.page_size('outages/'))
 
 
 def ignore_alert(outage):
@@ -41,32 +63,112 @@ def ignore_alert(outage):
     Call the API to ignore the alert for this outage.
     """
     print('Ignoring: {} @ {}'.format(outage['check_name'], outage['created_at']))
-    r = requests.post(outage['ignore_alert_url'], headers=headers)
-    r.raise_for_status()
-
-    # Delay to keep within rate limits
-    time.sleep(2.2)
-
-
-page = 0
-while True:
-    # Read through each page of outages between the given dates
-    page += 1
-    r = requests.get(opts.api + 'outages/',
-                    headers=headers,
-                    params={
-                        'start_date': str(getattr(opts, 'from')),
-                        'end_date': str(opts.to),
-                        'page_size': 250,
-                        'page': page,
-                    })
-
-    r.raise_for_status()
-    outages = r.json()['results']
-    if not outages:
-        break
-
-    # For each outage matching the check name prefix, ignore the outage
-    for outage in outages:
-        if outage['check_name'].startswith(opts.prefix) and not outage['ignored']:
-            ignore_alert(outage)
+    # Ignoring an alert twice is harmless, so it can be retried like a GET.
+    api.call('post', outage['ignore_alert_url'], idempotent=True)
+    journal.finish(outage['ignore_alert_url'])
+
+
+def load_outages(page):
+    """
+    Load one page of outages between the given dates.
+    """
+    try:
+        return api.call('get', 'outages/',
+                        params={
+                            'start_date': str(getattr(opts, 'from')),
+                            'end_date': str(opts.to),
+                            'page_size': page_size,
+                            'page': page,
+                        },
+                        fields=('check_name', 'created_at', 'ignored', 'ignore_alert_url'))
+    except (APIError, requests.HTTPError) as e:
+        # A resumed run whose journal reached the last page asks for the page after it.
+        if e.response is None or e.response.status_code != 404:
+            raise
+        return {'results': [], 'next': None}
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{}h{:02d}m{:02d}s'.format(hours, minutes, seconds) if hours else \
+        '{}m{:02d}s'.format(minutes, seconds)
+
+
+def print_progress(scanned, total, ignored, started, skipped=0):
+    elapsed = time.monotonic() - started
+    rate = ignored / elapsed if elapsed else 0.0
+    eta = elapsed * (total - skipped - scanned) / scanned if scanned else 0.0
+    print('Scanned {}/{} outages, ignored {} ({:.2f}/s), elapsed {}, ETA {}'.format(
+        skipped + scanned, total, ignored, rate, format_duration(elapsed),
+        format_duration(eta)))
+
+
+def record_cursor(unfinished_pages):
+    """
+    Journal the last page whose ignores have all been done, so that a resumed run
+    starts after it.
+    """
+    page = None
+    while unfinished_pages and all(f.done() and not f.exception()
+                                   for f in unfinished_pages[0][1]):
+        page = unfinished_pages.popleft()[0]
+    if page is not None:
+        journal.set_cursor(page)
+
+
+page = (journal.cursor or 0) + 1
+if opts.resume:
+    print('Resuming at page {}, {} alerts already ignored.'.format(
+        page, len(journal.finished)))
+
+started = time.monotonic()
+# Outages on the pages done by earlier runs.
+skipped = (page - 1) * page_size
+scanned = ignored = 0
+pending = set()
+# The pages still being worked on, oldest first, with the ignores sent for each.
+unfinished_pages = deque()
+with journal, ThreadPoolExecutor(max_workers=opts.workers) as workers, \
+        ThreadPoolExecutor(max_workers=1) as prefetcher:
+    next_page = prefetcher.submit(load_outages, page)
+    while next_page is not None:
+        # Read through each page of outages between the given dates, fetching the
+        # following page while this one's ignores are in flight.
+        r = next_page.result()
+        outages = r['results']
+        if not outages:
+            break
+        next_page = prefetcher.submit(load_outages, page + 1) if r.get('next') else None
+
+        # For each outage matching the check name prefix, ignore the outage
+        sent = []
+        for outage in outages:
+            if (outage['check_name'].startswith(opts.prefix) and not outage['ignored'] and
+                    outage['ignore_alert_url'] not in journal.finished):
+                # Bound the queue so memory stays flat however many outages match.
+                while len(pending) >= opts.workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                        ignored += 1
+                    record_cursor(unfinished_pages)
+                future = workers.submit(ignore_alert, outage)
+                pending.add(future)
+                sent.append(future)
+        unfinished_pages.append((page, sent))
+        record_cursor(unfinished_pages)
+
+        scanned += len(outages)
+        print_progress(scanned, r.get('count') or skipped + scanned, ignored, started,
+                       skipped)
+        page += 1
+
+    for future in pending:
+        future.result()
+        ignored += 1
+    record_cursor(unfinished_pages)
+
+elapsed = time.monotonic() - started
+print('\nIgnored {} of {} outages scanned in {} ({:.2f} ignores/s).'.format(
+    ignored, scanned, format_duration(elapsed), ignored / elapsed if elapsed else 0.0))
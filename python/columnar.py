@@ -0,0 +1,147 @@
+"""Columnar files of check info and stats, for download_check_stats.py and
+rollup_check_stats.py.
+
+Each check becomes one row of flat columns: its info, its stats totals and its mean
+response time over the days downloaded. Rows are written as Parquet when pyarrow is
+installed, or as a NumPy `.npz` archive of one array per column.
+"""
+import json
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# (column, NumPy dtype) for each row; tags are joined with commas.
+COLUMNS = (
+    ('pk', 'int64'),
+    ('name', 'str'),
+    ('check_type', 'str'),
+    ('tags', 'str'),
+    ('is_paused', 'bool'),
+    ('state_is_up', 'bool'),
+    ('msp_interval', 'int64'),
+    ('days', 'int64'),
+    ('outages', 'int64'),
+    ('downtime_secs', 'int64'),
+    ('uptime', 'float64'),
+    ('response_time', 'float64'),
+)
+
+# Rows converted at a time when writing Parquet.
+BATCH_SIZE = 10000
+
+FORMATS = ('parquet', 'npz')
+
+
+def record_row(record):
+    """Flatten a merged check+stats record into a tuple of COLUMNS values."""
+    totals = record.get('totals') or {}
+    statistics = record.get('statistics') or []
+    response_times = [s['response_time'] for s in statistics
+                      if s.get('response_time') is not None]
+    return (
+        record['pk'],
+        record.get('name') or '',
+        record.get('check_type') or '',
+        ','.join(record.get('tags') or []),
+        bool(record.get('is_paused')),
+        bool(record.get('state_is_up', True)),
+        record.get('msp_interval') or 0,
+        len(statistics),
+        totals.get('outages') or 0,
+        totals.get('downtime_secs') or 0,
+        totals['uptime'] if totals.get('uptime') is not None else math.nan,
+        sum(response_times) / len(response_times) if response_times else math.nan,
+    )
+
+
+def require(fmt):
+    """Exit with a message when the libraries for a format are not installed."""
+    if np is None:
+        raise SystemExit('NumPy is required for {} files; install it with '
+                         '"pip install numpy".'.format(fmt))
+    if fmt == 'parquet' and pa is None:
+        raise SystemExit('pyarrow is required for Parquet files; install it with '
+                         '"pip install pyarrow" or use npz.')
+
+
+def _arrays(rows):
+    """Turn a list of row tuples into {column: array}."""
+    columns = list(zip(*rows)) if rows else [()] * len(COLUMNS)
+    return {name: np.array(values, dtype=str if dtype == 'str' else dtype)
+            for (name, dtype), values in zip(COLUMNS, columns)}
+
+
+def write_parquet(records, path):
+    """Stream records to a Parquet file, a batch of rows at a time."""
+    require('parquet')
+    schema = pa.schema([(name, pa.string() if dtype == 'str' else pa.from_numpy_dtype(dtype))
+                        for name, dtype in COLUMNS])
+    with pq.ParquetWriter(path, schema) as writer:
+        batch = []
+        for record in records:
+            batch.append(record_row(record))
+            if len(batch) >= BATCH_SIZE:
+                writer.write_table(pa.table(_arrays(batch), schema=schema))
+                batch = []
+        if batch:
+            writer.write_table(pa.table(_arrays(batch), schema=schema))
+
+
+def write_npz(records, path):
+    """Write records to a compressed NumPy archive with one array per column.
+
+    The archive is written in one go, so the (compact) rows are held in memory.
+    """
+    require('npz')
+    rows = [record_row(record) for record in records]
+    with open(path, 'wb') as f:
+        np.savez_compressed(f, **_arrays(rows))
+
+
+WRITERS = {
+    'parquet': write_parquet,
+    'npz': write_npz,
+}
+
+
+def read_records(path):
+    """Read the records of a JSON array (download_check_stats.py's default output) or
+    an ndjson file."""
+    with open(path) as f:
+        start = f.read(1)
+        while start.isspace():
+            start = f.read(1)
+        f.seek(0)
+        try:
+            if start == '[':
+                return json.load(f)
+            return [json.loads(line) for line in f if line.strip()]
+        except ValueError as e:
+            raise SystemExit('{} is not a JSON or ndjson file of check stats ({}); write one '
+                             'with download_check_stats.py --format ndjson.'.format(path, e))
+
+
+def read_columns(path):
+    """Read a Parquet, npz, JSON or ndjson file into {column: NumPy array}."""
+    if path.endswith('.parquet'):
+        require('parquet')
+        table = pq.read_table(path, columns=[name for name, _ in COLUMNS])
+        return {name: table.column(name).to_numpy(zero_copy_only=False).astype(
+                    str if dtype == 'str' else dtype)
+                for name, dtype in COLUMNS}
+    if path.endswith('.npz'):
+        require('npz')
+        with np.load(path) as data:
+            return {name: data[name] for name, _ in COLUMNS}
+
+    require('ndjson')
+    return _arrays([record_row(record) for record in read_records(path)])
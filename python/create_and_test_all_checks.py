@@ -3,36 +3,52 @@ import argparse
 import time
 import json
 import random
-import requests
+import statistics
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-API_URL = ''
-TOKEN = ''
+from journal import Journal
+from uptime_api import UptimeAPI
+
+API = None
+JOURNAL = None
 CONTACT_GROUPS = []
 LOCATIONS = ['US-East', 'US-West']
 TAGS = []
+WORKERS = 8
+
+# Minutes to wait for a check of each type to reach its expected state, unless
+# overridden for all types with --deadline.
+DEADLINE = None
+DEFAULT_DEADLINE = 10
+CHECK_TYPE_DEADLINES = {
+    'API': 15,
+    'TRANSACTION': 15,
+}
+
+# Seconds between polls of the created checks, growing after each poll.
+POLL_DELAY = 15
+POLL_MAX_DELAY = 120
+POLL_BACKOFF = 1.5
+
+# The key in the journal of the check each worker thread is creating.
+creating = threading.local()
+
+
+def find_check(name):
+    """Return the check with exactly this name, or None."""
+    r = API.call('get', 'checks/', params={'search': name})
+    return next((c for c in r['results'] if c['name'] == name), None)
 
 
 def call_api(method, data=None):
-    headers = {
-        'Authorization': 'Token %s' % TOKEN
-    }
-    url = API_URL + method
     if data is None:
-        res = requests.get(url, headers=headers)
-    else:
-        res = requests.post(url, json=data, headers=headers)
-    res = res.json()
-    if 'messages' in res:
-        if res['messages']['errors']:
-            msg = res['messages']
-            text = '%s: %s' % (msg['error_code'], msg['error_message'])
-            if 'error_fields' in msg:
-                text += ' Field errors: '
-                for k, v in msg['error_fields'].items():
-                    text += '%s: %s' % (k, v)
-            raise Exception(text)
-        return res['results']
-    return res
+        return API.call('get', method.lstrip('/'))
+    # Every check gets a unique name, so a create that failed with a 5xx, or was cut
+    # off by the script stopping, can be checked for before it is sent again.
+    JOURNAL.begin(creating.key, data['name'])
+    return API.call('post', method.lstrip('/'), json=data,
+                    recover=lambda: find_check(data['name']))
 
 
 def gen_name(initial):
@@ -386,6 +402,26 @@ def up_or_down(status):
     return 'UP' if status else 'DOWN'
 
 
+def create_check(key, fnc, args):
+    """Create a check with fnc, unless the journal shows an earlier run created it.
+    Returns the check and the time.monotonic() it was created at."""
+    check = None
+    if key in JOURNAL.finished:
+        check, created_at = JOURNAL.finished[key]
+    elif key in JOURNAL.begun:
+        # An earlier run stopped while creating this check, so it may exist. When it
+        # does, its age is counted from now.
+        check, created_at = find_check(JOURNAL.begun[key]), time.time()
+    if check is None:
+        creating.key = key
+        check, created_at = fnc(*args), time.time()
+    if key not in JOURNAL.finished:
+        check = {k: check[k] for k in ('pk', 'name', 'check_type', 'msp_interval')
+                 if k in check}
+        JOURNAL.finish(key, [check, created_at])
+    return check, time.monotonic() - (time.time() - created_at)
+
+
 def create_checks():
     parse_args()
     print("Creating checks...")
@@ -442,37 +478,109 @@ def create_checks():
 
 
     checks = []
-    for fnc, args, status in defs:
-        try:
-            check = fnc(*args)
-            checks.append([check, status])
-            print("Created check type: %s, name: %s, id: %s" % (
-                check['check_type'], check['name'], check['pk']))
-        except Exception as e:
-            print("Failed to create check %s %s: %s" % (
-                fnc.__name__, args, str(e)))
-        time.sleep(10)  # prevent rate limit exception
-
-    wait = 10
-    while wait > 0:
-        print(f'Waiting {wait} minutes...')
-        time.sleep(60)
-        wait -= 1
-
-    print("Checking statuses...")
-    for check, status in checks:
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        # Creation is paced by the client's rate limiter for check creation.
+        futures = [(pool.submit(create_check, str(i), fnc, args), fnc, args, status)
+                   for i, (fnc, args, status) in enumerate(defs)]
+        for future, fnc, args, status in futures:
+            try:
+                check, created = future.result()
+                checks.append([check, status, created])
+                print("%s check type: %s, name: %s, id: %s" % (
+                    'Created' if created > started else 'Resumed',
+                    check['check_type'], check['name'], check['pk']))
+            except Exception as e:
+                print("Failed to create check %s %s: %s" % (
+                    fnc.__name__, args, str(e)))
+
+    for check, status, created in checks:
         if status is None:
             print("Check %d status can only be checked using website" % check['pk'])
-            continue
 
-        check = call_api('/checks/%d/' % check['pk'])
-        if check['state_is_up'] != status:
-            print("Check %d status %s is not as expected %s" % (
-                check['pk'], up_or_down(check['state_is_up']), up_or_down(status)))
+    JOURNAL.close()
+
+    results = wait_for_expected_states(checks)
+    report_results(results)
+
+
+def load_check_states(pks):
+    """Load the state of the given checks, reading all test checks a page at a time
+    rather than one request per check."""
+    states = {}
+    page = 1
+    page_size = API.page_size('checks/')
+    while True:
+        r = API.call('get', 'checks/',
+                     params={'search': 'API_TEST_', 'page': page, 'page_size': page_size})
+        states.update((c['pk'], c['state_is_up']) for c in r['results'] if c['pk'] in pks)
+        if not r['next'] or len(states) == len(pks):
+            break
+        page += 1
+    return states
+
+
+def deadline_for(check):
+    """Seconds a check is given to reach its expected state."""
+    if DEADLINE is not None:
+        return DEADLINE * 60
+    return CHECK_TYPE_DEADLINES.get(check['check_type'], DEFAULT_DEADLINE) * 60
+
+
+def wait_for_expected_states(checks):
+    """Poll the checks until each one has its expected state or its deadline passes.
+
+    A check only counts as settled once it has been running for at least one of its
+    intervals, so that the default state of a new check is not taken as a result.
+    Returns [check, expected state, seconds to settle or None] for each check.
+    """
+    pending = {check['pk']: (check, status, created)
+               for check, status, created in checks if status is not None}
+    results = []
+    delay = POLL_DELAY
+    print("Checking statuses...")
+    while pending:
+        # Wake up early if a deadline falls before the next poll.
+        next_deadline = min(created + deadline_for(check)
+                            for check, status, created in pending.values())
+        time.sleep(max(0.0, min(delay, next_deadline - time.monotonic())))
+        delay = min(delay * POLL_BACKOFF, POLL_MAX_DELAY)
+
+        states = load_check_states(set(pending))
+        now = time.monotonic()
+        for pk, (check, status, created) in list(pending.items()):
+            age = now - created
+            if states.get(pk) == status and age >= check.get('msp_interval', 1) * 60:
+                results.append([check, status, age])
+                del pending[pk]
+            elif age >= deadline_for(check):
+                print("Check %d status %s is not as expected %s" % (
+                    pk, up_or_down(states.get(pk)), up_or_down(status)))
+                results.append([check, status, None])
+                del pending[pk]
+        print("%d checks settled, %d still pending..." % (len(results), len(pending)))
+    return results
+
+
+def report_results(results):
+    """Print the time each check type took to reach its expected state."""
+    by_type = {}
+    for check, status, seconds in results:
+        by_type.setdefault(check['check_type'], []).append(seconds)
+
+    print("\n%-14s %7s %9s %9s %9s" % ('Check type', 'Correct', 'Min', 'Median', 'Max'))
+    for check_type, times in sorted(by_type.items()):
+        settled = [t for t in times if t is not None]
+        if settled:
+            print("%-14s %3d/%-3d %8.0fs %8.0fs %8.0fs" % (
+                check_type, len(settled), len(times), min(settled),
+                statistics.median(settled), max(settled)))
+        else:
+            print("%-14s %3d/%-3d %9s %9s %9s" % (check_type, 0, len(times), '-', '-', '-'))
 
 
 def parse_args():
-    global API_URL, TOKEN, CONTACT_GROUPS, LOCATIONS, TAGS
+    global API, JOURNAL, CONTACT_GROUPS, LOCATIONS, TAGS, DEADLINE
     parser = argparse.ArgumentParser(description='Create and test all kinds of checks.')
     parser.add_argument('--token', required=True,
                         help='Your Uptime.com API Token')
@@ -485,16 +593,31 @@ def parse_args():
     parser.add_argument('--api', default='https://uptime.com/api/v1/',
                         help='(optional) The Uptime.com API endpoint to use, eg. '
                              'https://uptime.com/api/v1/')
+    parser.add_argument('--deadline', type=float,
+                        help='(optional) Minutes to wait for every check to reach its expected '
+                             'state, instead of the default for its type')
+    parser.add_argument('--journal', default='create_and_test_all_checks.journal',
+                        help='(optional) File to record the checks created in, default '
+                             'create_and_test_all_checks.journal')
+    parser.add_argument('--resume', action='store_true',
+                        help='(optional) Test the checks created by an interrupted run with '
+                             'the same options, creating only the ones it did not get to')
 
     opts = parser.parse_args()
-    API_URL = opts.api
-    TOKEN = opts.token
+    DEADLINE = opts.deadline
+    API = UptimeAPI(opts.token, opts.api, pool_size=WORKERS)
     if opts.contacts is not None:
         CONTACT_GROUPS = opts.contacts.split(',')
     if opts.locations is not None:
         LOCATIONS = opts.locations.split(',')
     if opts.tags is not None:
         TAGS = opts.tags.split(',')
+    JOURNAL = Journal(opts.journal, {
+        'api': opts.api,
+        'contacts': CONTACT_GROUPS,
+        'locations': LOCATIONS,
+        'tags': TAGS,
+    }, resume=opts.resume)
 
 
 if __name__ == '__main__':
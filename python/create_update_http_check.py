@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 import argparse
 
-import requests
+from uptime_api import UptimeAPI
 
 
 def parse_args():
@@ -16,81 +16,72 @@ def parse_args():
 
 
 opts = parse_args()
-headers = {'Authorization': 'token ' + opts.token}
+api = UptimeAPI(opts.token, opts.api)
 
 print('\n1. Creating HTTP check...')
-r = requests.post(opts.api + 'checks/add-http/',
-                  headers=headers,
-                  json={
-                      'name': 'API Sample: HTTP Create & Update',
-                      'msp_interval': 5,
-                      'msp_address': 'http://google.com',
-                      'contact_groups': ['Default'],
-                      'locations': ['US-East', 'US-West', 'GBR'],
-                  })
+r = api.request('post', 'checks/add-http/',
+                json={
+                    'name': 'API Sample: HTTP Create & Update',
+                    'msp_interval': 5,
+                    'msp_address': 'http://google.com',
+                    'contact_groups': ['Default'],
+                    'locations': ['US-East', 'US-West', 'GBR'],
+                })
 print(r.text)
-r.raise_for_status()
-check_pk = r.json()['results']['pk']
+check_pk = api.unwrap(r)['pk']
 
 print('\n2. Updating interval...')
-r = requests.patch(opts.api + 'checks/{pk}/'.format(pk=check_pk),
-                  headers=headers,
-                  json={
-                      'msp_interval': 3,
-                  })
+r = api.request('patch', 'checks/{pk}/', pk=check_pk,
+                json={
+                    'msp_interval': 3,
+                })
 print(r.text)
-r.raise_for_status()
+api.unwrap(r)
 
 
 print('\n3. Updating contacts...')
-r = requests.patch(opts.api + 'checks/{pk}/replace-contact-groups/'.format(pk=check_pk),
-                  headers=headers,
-                  json={
-                      'contact_groups': ['Default'],
-                  })
+r = api.request('patch', 'checks/{pk}/replace-contact-groups/', pk=check_pk,
+                json={
+                    'contact_groups': ['Default'],
+                })
 print(r.text)
-r.raise_for_status()
+api.unwrap(r)
 
 
 print('\n4. Updating locations...')
-r = requests.patch(opts.api + 'checks/{pk}/replace-locations/'.format(pk=check_pk),
-                  headers=headers,
-                  json={
-                      'locations': ['US-East', 'GBR'],
-                  })
+r = api.request('patch', 'checks/{pk}/replace-locations/', pk=check_pk,
+                json={
+                    'locations': ['US-East', 'GBR'],
+                })
 print(r.text)
-r.raise_for_status()
+api.unwrap(r)
 
 
 print('\n5. Creating tag...')
-r = requests.post(opts.api + 'check-tags/',
-                  headers=headers,
-                  json={
-                      'tag': 'API Sample Tag',
-                      'color_hex': '#51e898',
-                  })
+r = api.request('post', 'check-tags/',
+                json={
+                    'tag': 'API Sample Tag',
+                    'color_hex': '#51e898',
+                })
 print(r.text)
 
 
 print('\n6. Assigning tag to check...')
-r = requests.patch(opts.api + 'checks/{pk}/replace-tags/'.format(pk=check_pk),
-                  headers=headers,
-                  json={
-                      'tags': ['API Sample Tag'],
-                  })
+r = api.request('patch', 'checks/{pk}/replace-tags/', pk=check_pk,
+                json={
+                    'tags': ['API Sample Tag'],
+                })
 print(r.text)
-r.raise_for_status()
+api.unwrap(r)
 
 
 print('\n7. Pause check...')
-r = requests.post(opts.api + 'checks/{pk}/pause/'.format(pk=check_pk),
-                  headers=headers)
+r = api.request('post', 'checks/{pk}/pause/', pk=check_pk)
 print(r.text)
-r.raise_for_status()
+api.unwrap(r)
 
 
 print('\n8. Resume check...')
-r = requests.post(opts.api + 'checks/{pk}/resume/'.format(pk=check_pk),
-                  headers=headers)
+r = api.request('post', 'checks/{pk}/resume/', pk=check_pk)
 print(r.text)
-r.raise_for_status()
+api.unwrap(r)
@@ -1,8 +1,14 @@
 #!/usr/bin/env python3
 import argparse
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import requests
 
+from uptime_api import APIError, UptimeAPI
+
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Delete all API sample checks named '
@@ -12,31 +18,99 @@ def parse_args():
     parser.add_argument('--api', default='https://uptime.com/api/v1/',
                         help='(optional) The Uptime.com API endpoint to use, eg. '
                              'https://uptime.com/api/v1/')
+    parser.add_argument('--prefix', default='API Sample:',
+                        help='(optional) Delete checks whose name starts with this, '
+                             'default "API Sample:"')
+    parser.add_argument('--regex',
+                        help='(optional) Delete checks whose name matches this regular '
+                             'expression instead of --prefix')
+    parser.add_argument('--search',
+                        help='(optional) Text the API should search check names for, '
+                             'default the --prefix, or every check when --regex is used')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='(optional) Number of checks to delete at once, default 4')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='(optional) List the checks that would be deleted without '
+                             'deleting them')
 
     return parser.parse_args()
 
 
 opts = parse_args()
-headers = {'Authorization': 'token ' + opts.token}
+api = UptimeAPI(opts.token, opts.api, pool_size=opts.workers)
+
+pattern = re.compile(opts.regex) if opts.regex else None
+if opts.search is not None:
+    search = opts.search
+else:
+    search = '' if pattern else opts.prefix
+
+
+def matches(name):
+    if pattern:
+        return pattern.search(name) is not None
+    return name.startswith(opts.prefix)
+
 
-print('\n1. Search for checks that include "API Sample:"...')
-r = requests.get(opts.api + 'checks/',
-                 headers=headers,
+print('\n1. Search for checks that include "{}"...'.format(search))
+# Collect every match before deleting anything, so deletes cannot shift later pages.
+checks = []
+page = 1
+page_size = api.page_size('checks/')
+while True:
+    r = api.call('get', 'checks/',
                  params={
-                    'search': "API Sample:",
-                    'page_size': 250
-                 })
-print(r.text)
-r.raise_for_status()
-checks = r.json()['results']
+                     'search': search,
+                     'page_size': page_size,
+                     'page': page,
+                 },
+                 fields=('pk', 'name'))
+    checks.extend(c for c in r['results'] if matches(c['name']))
+    print('Page {}: {} of {} checks searched, {} to delete'.format(
+        page, min(page * page_size, r['count']), r['count'], len(checks)))
+    if not r['next']:
+        break
+    page += 1
 
 
-print('\n2. Delete each check whose name starts with "API Sample:"...')
-for check in checks:
-    if check['name'].startswith('API Sample:'):
+def delete_check(check):
+    try:
+        api.call('delete', 'checks/{pk}/', pk=check['pk'])
+    except (APIError, requests.HTTPError) as e:
+        # A delete retried after a dropped response finds the check already gone.
+        if e.response is None or e.response.status_code != 404:
+            raise
+    return check
+
+
+if opts.dry_run:
+    print('\n2. Checks that would be deleted:')
+    for check in checks:
         print('DELETE - ' + check['name'])
-        r = requests.delete(opts.api + 'checks/{pk}/'.format(pk=check['pk']),
-                            headers=headers)
-        print(r.text)
-        print('')
-        r.raise_for_status()
+    print('\n{} checks would be deleted.'.format(len(checks)))
+else:
+    print('\n2. Delete each matching check...')
+    started = time.monotonic()
+    deleted = failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, opts.workers)) as workers:
+        futures = {workers.submit(delete_check, check): check for check in checks}
+        for future in as_completed(futures):
+            check = futures[future]
+            try:
+                future.result()
+                deleted += 1
+                print('DELETE - ' + check['name'])
+            except Exception as e:
+                failed += 1
+                print('FAILED - {}: {}'.format(check['name'], e))
+
+            done = deleted + failed
+            if done % 100 == 0 and done < len(checks):
+                elapsed = time.monotonic() - started
+                print('{}/{} done, {:.1f} deletes/s'.format(done, len(checks), done / elapsed))
+
+    elapsed = time.monotonic() - started
+    print('\nDeleted {} checks ({} failed) in {:.1f}s, {:.1f} deletes/s.'.format(
+        deleted, failed, elapsed, deleted / elapsed if elapsed else 0.0))
+    if failed:
+        sys.exit(1)
@@ -1,17 +1,39 @@
 #!/usr/bin/env python3
 import argparse
+import csv
 import datetime as dt
+import heapq
+import itertools
 import json
+import os
 import sys
-from urllib.parse import urlencode
+import tempfile
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
 
-import requests
+import columnar
+import stats_cache
+from pagination import PageFanOut
+from rate_limit import DEFAULT_RATES
+from uptime_api import UptimeAPI
 
 CONFIG = {
     'api': 'https://uptime.com/api/v1/',
-    'token': '',
-    'headers': {},
-    'page_size': 250,
+    'client': None,
+    # Pages of checks+stats fetched ahead of the page being written out.
+    'prefetch_depth': 2,
+    # Pages of checks loaded at once.
+    'fan_out': 4,
+    # Records held in memory per sorted run when --sort is used with streaming output.
+    'sort_run_size': 10000,
+    # Maximum number of sorted runs merged at once.
+    'sort_fan_in': 64,
+    # A stats_cache.StatsCache when --cache is used.
+    'cache': None,
+    'refresh': False,
+    # Stats fields left out of records combined from cached days, see stats_cache.combine().
+    'dropped_fields': set(),
 }
 
 
@@ -28,58 +50,264 @@ def parse_args():
                              'https://uptime.com/api/v1/')
     parser.add_argument('-d', '--date', required=True, type=parse_date,
                         help='Date to start saving statistics from, YYYY-MM-DD')
+    parser.add_argument('-f', '--format',
+                        choices=['json', 'ndjson', 'csv'] + list(columnar.FORMATS),
+                        default='json',
+                        help='(optional) Output format, default json. ndjson is streamed '
+                             'one check at a time as each page is downloaded, and csv is '
+                             'spooled to disk until every column is known. '
+                             'parquet and npz write one row of flat columns per check for '
+                             'rollup_check_stats.py, and need --output.')
+    parser.add_argument('-o', '--output',
+                        help='(optional) File to write to instead of standard output')
+    parser.add_argument('--sort', action='store_true',
+                        help='(optional) Sort ndjson/csv output by check pk, using an '
+                             'on-disk merge sort so memory use stays flat')
+    parser.add_argument('--prefetch', type=int, default=CONFIG['prefetch_depth'],
+                        help='(optional) Number of pages to download ahead, default {}'.format(
+                            CONFIG['prefetch_depth']))
+    parser.add_argument('--fan-out', type=int, default=CONFIG['fan_out'],
+                        help='(optional) Number of pages of checks to load at once after '
+                             'the first, default {}; 1 loads them one at a time'.format(
+                            CONFIG['fan_out']))
+    parser.add_argument('--read-rate', type=float,
+                        help='(optional) Read requests per second to allow, default {:g} at '
+                             'first, rising to {:g} while the API keeps up. Raise it to let '
+                             'pages load concurrently'.format(DEFAULT_RATES['read'][0],
+                                                              DEFAULT_RATES['read'][2]))
+    parser.add_argument('--cache',
+                        help='(optional) SQLite file used to cache the stats of days that have '
+                             'ended, so later runs only download new days')
+    parser.add_argument('--refresh', action='store_true',
+                        help='(optional) Ignore the cached stats and download everything again, '
+                             'updating the cache')
 
     return parser.parse_args()
 
 
-def make_api_call(label, method, endpoint, pk=None, params=None, json=None):
-    """Make an Uptime.com API call with the given method, endpoint and parameters."""
-    url = CONFIG['api'] + endpoint.format(pk=pk)
-    qs = '?' + urlencode(params) if params else ''
-    sys.stderr.write('{} - {} {}{}\n'.format(label, method.upper(), url, qs))
+def load_checks_page(page, page_size):
+    return CONFIG['client'].call('get', 'checks/',
+                                 params={'page': page, 'page_size': page_size},
+                                 label='Loading checks (page {})'.format(page))
 
-    r = requests.request(method, url, params=params, json=json, headers=CONFIG['headers'])
-    r.raise_for_status()
-    return r.json()
+
+def load_stats(page, pks, start_date):
+    """Load the stats of the given checks, in batches sized by the page size tuning
+    so that long date ranges do not time out."""
+    client = CONFIG['client']
+    pks = list(pks)
+    batch_size = client.page_size('checks/bulk/stats/')
+    stats = []
+    for i in range(0, len(pks), batch_size):
+        batch = pks[i:i + batch_size]
+        r = client.request('get', 'checks/bulk/stats/',
+                           params={'pk': ','.join(str(pk) for pk in batch),
+                                   'start_date': str(start_date),
+                                   'include_alerts': '1'},
+                           page_size=batch_size,
+                           label='Reading check stats since {} (page {})'.format(
+                               start_date, page))
+        res = client.unwrap(r)
+        key, requested, elapsed = r.page_timing
+        client.page_sizes.record(key, requested, len(batch), elapsed, len(r.content))
+        stats.extend(res['checks'])
+    return stats
+
+
+def load_stats_page(page, checks, from_date):
+    """Merge the stats for one page of checks into the check info."""
+    stats = {chk['pk']: chk for chk in checks}
+    cache = CONFIG['cache']
+    if cache is None:
+        for stat in load_stats(page, stats, from_date):
+            stats[stat['pk']].update(stat)
+        return list(stats.values())
+
+    # Only request the days that are not cached yet, grouping checks that share the
+    # same first missing day into one request. Usually that is the whole page.
+    cached = {pk: {} for pk in stats} if CONFIG['refresh'] else cache.load(list(stats), from_date)
+    groups = defaultdict(list)
+    for pk in stats:
+        groups[cache.first_missing_day(cached[pk], from_date)].append(pk)
+
+    today = dt.datetime.utcnow().date()
+    for start_date, pks in sorted(groups.items()):
+        for stat in load_stats(page, pks, start_date):
+            days = stats_cache.split_by_day(stat, start_date, today)
+            if days is None:
+                stats[stat['pk']].update(stat)
+                continue
+            cache.store(stat['pk'], days)
+            days.update((day, data) for day, data in cached[stat['pk']].items()
+                        if day < start_date)
+            stats[stat['pk']].update(stats_cache.combine(stat, days, CONFIG['dropped_fields']))
+    return list(stats.values())
+
+
+def iter_checks_stats(from_date):
+    """Yield info and stats for all checks in the account, one page of checks at a time.
+
+    Requests are pipelined: pages of checks are loaded `fan_out` at a time once the
+    first page gives their number, and the stats for up to `prefetch_depth` pages are
+    loaded while earlier pages are written out.
+    """
+    depth = max(1, CONFIG['prefetch_depth'])
+    page_size = CONFIG['client'].page_size('checks/')
+    checks_pages = PageFanOut(lambda page: load_checks_page(page, page_size), page_size,
+                              max(1, CONFIG['fan_out']))
+    seen_pks = set()
+    with ThreadPoolExecutor(max_workers=depth) as pool:
+        pending = deque()
+        for page, r in enumerate(checks_pages, 1):
+            # A check that moved to a later page while the pages loaded is only kept once.
+            checks = [chk for chk in r['results'] if chk['pk'] not in seen_pks]
+            seen_pks.update(chk['pk'] for chk in checks)
+            pending.append(pool.submit(load_stats_page, page, checks, from_date))
+            if len(pending) >= depth:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    if CONFIG['dropped_fields']:
+        sys.stderr.write('Left out stats fields that cannot be rebuilt from cached days: '
+                         '{}\n'.format(', '.join(sorted(CONFIG['dropped_fields']))))
+
+    if checks_pages.shifted:
+        sys.stderr.write('Checks were added or removed during the download, so some of '
+                         'them may be missing.\n')
+    elif CONFIG['cache'] is not None:
+        # Drop cached stats for checks that have been deleted from the account. Not
+        # after a shifted listing, which may have missed checks that still exist.
+        CONFIG['cache'].prune(seen_pks)
 
 
 def load_all_checks_stats(from_date):
     """Load info and stats for all checks in the account, spanning multiple pages
     of results if necessary."""
-    page = 1
-    stats = {}
-    while True:
-        r = make_api_call('Loading checks (page {})'.format(page),
-                          'get', 'checks/',
-                          params={'page': page, 'page_size': CONFIG['page_size']})
-        next_page = r['next']
-        pks = [chk['pk'] for chk in r['results']]
-        stats.update({chk['pk']: chk for chk in r['results']})
-
-        r = make_api_call('Reading check stats (page {})'.format(page),
-                          'get', 'checks/bulk/stats/',
-                          params={'pk': ','.join(str(pk) for pk in pks),
-                                  'start_date': str(from_date),
-                                  'include_alerts': '1'})
-        for stat in r['checks']:
-            stats[stat['pk']].update(stat)
+    stats = []
+    for page in iter_checks_stats(from_date):
+        stats.extend(page)
+
+    return sorted(stats, key=lambda x: x['pk'])
+
+
+def _write_run(directory, records):
+    """Write records to a new temporary NDJSON file and return its path."""
+    fd, path = tempfile.mkstemp(suffix='.ndjson', dir=directory)
+    with os.fdopen(fd, 'w') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+    return path
 
-        if not next_page:
-            break
-        else:
-            page += 1
 
-    return sorted(stats.values(), key=lambda x: x['pk'])
+def _merge_runs(directory, paths, key):
+    """Lazily merge sorted NDJSON runs, a group of files at a time."""
+    # Keep the number of open files bounded by first merging runs into larger runs.
+    while len(paths) > CONFIG['sort_fan_in']:
+        merged = []
+        for i in range(0, len(paths), CONFIG['sort_fan_in']):
+            merged.append(_write_run(directory, _merge_runs(
+                directory, paths[i:i + CONFIG['sort_fan_in']], key)))
+        paths = merged
+
+    files = [open(path) for path in paths]
+    try:
+        yield from heapq.merge(*(map(json.loads, f) for f in files), key=key)
+    finally:
+        for f in files:
+            f.close()
+
+
+def external_sort(pages, key):
+    """Sort records arriving in pages, spilling sorted runs to disk so that only one
+    run needs to be held in memory at a time."""
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        run = []
+        for records in pages:
+            run.extend(records)
+            if len(run) >= CONFIG['sort_run_size']:
+                paths.append(_write_run(directory, sorted(run, key=key)))
+                run = []
+        if run:
+            paths.append(_write_run(directory, sorted(run, key=key)))
+            run = []
+
+        yield from _merge_runs(directory, paths, key)
+
+
+def write_ndjson(records, out):
+    """Write one JSON document per line."""
+    for record in records:
+        out.write(json.dumps(record) + '\n')
+
+
+def write_csv(records, out):
+    """Write records as CSV, with a column for every key found in any record. Records
+    are spooled to a temporary file while the columns are collected, so memory use
+    stays flat. Nested values such as alerts are JSON encoded."""
+    fieldnames = {}
+    with tempfile.TemporaryFile('w+') as spool:
+        for record in records:
+            fieldnames.update(dict.fromkeys(record))
+            spool.write(json.dumps(record) + '\n')
+        spool.seek(0)
+
+        writer = csv.DictWriter(out, fieldnames=list(fieldnames))
+        writer.writeheader()
+        for line in spool:
+            writer.writerow({k: json.dumps(v) if isinstance(v, (dict, list)) else v
+                             for k, v in json.loads(line).items()})
+
+
+WRITERS = {
+    'ndjson': write_ndjson,
+    'csv': write_csv,
+}
 
 
 def main():
     """Program entry point."""
     opts = parse_args()
+    if opts.format in columnar.WRITERS:
+        if not opts.output:
+            sys.exit('--output is required for {} files.'.format(opts.format))
+        columnar.require(opts.format)
     CONFIG['api'] = opts.api or CONFIG['api']
-    CONFIG['headers'] = {'Authorization': 'token ' + opts.token}
+    CONFIG['prefetch_depth'] = opts.prefetch
+    CONFIG['fan_out'] = opts.fan_out
+    CONFIG['client'] = UptimeAPI(opts.token, CONFIG['api'], log_file=sys.stderr,
+                                 pool_size=max(1, opts.prefetch) + max(1, opts.fan_out),
+                                 rate_limits={'read': opts.read_rate} if opts.read_rate else None)
+    if opts.cache:
+        CONFIG['cache'] = stats_cache.StatsCache(
+            opts.cache, scope=stats_cache.cache_scope(CONFIG['api'], opts.token))
+        CONFIG['refresh'] = opts.refresh
 
-    stats = load_all_checks_stats(opts.date)
-    print(json.dumps(stats, indent=4))
+    if opts.format in columnar.WRITERS:
+        pages = iter_checks_stats(opts.date)
+        if opts.sort:
+            records = external_sort(pages, key=itemgetter('pk'))
+        else:
+            records = itertools.chain.from_iterable(pages)
+        columnar.WRITERS[opts.format](records, opts.output)
+        return
+
+    out = open(opts.output, 'w', newline='') if opts.output else sys.stdout
+    try:
+        if opts.format == 'json':
+            stats = load_all_checks_stats(opts.date)
+            out.write(json.dumps(stats, indent=4) + '\n')
+        else:
+            pages = iter_checks_stats(opts.date)
+            if opts.sort:
+                records = external_sort(pages, key=itemgetter('pk'))
+            else:
+                records = itertools.chain.from_iterable(pages)
+            WRITERS[opts.format](records, out)
+    finally:
+        if out is not sys.stdout:
+            out.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+import argparse
+import csv
+import datetime as dt
+import sys
+import time
+
+import numpy as np
+
+from pagination import PageFanOut
+from uptime_api import UptimeAPI
+
+CONFIG = {
+    'api': 'https://uptime.com/api/v1/',
+    'client': None,
+    # Pages of outages loaded at once.
+    'fan_out': 4,
+    # Outages buffered before they are merged into the down intervals so far.
+    'compact_rows': 1000000,
+}
+
+OUTAGE_FIELDS = ('check_pk', 'check_name', 'created_at', 'resolved_at', 'ignored')
+CHECK_FIELDS = ('pk', 'tags')
+UNTAGGED = '(no tag)'
+
+
+def parse_date(d):
+    return dt.datetime.strptime(d, '%Y-%m-%d').date()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Report downtime, MTTR and outage counts per '
+                                                 'check and per tag from the outages in a '
+                                                 'date range.')
+    parser.add_argument('--token', required=True,
+                        help='Your Uptime.com API Token')
+    parser.add_argument('--api',
+                        help='(optional) The Uptime.com API endpoint to use, eg. '
+                             'https://uptime.com/api/v1/')
+    parser.add_argument('--from', required=True, type=parse_date,
+                        help='The first day to report on, in YYYY-MM-DD format.')
+    parser.add_argument('--to', required=True, type=parse_date,
+                        help='The last day to report on, in YYYY-MM-DD format.')
+    parser.add_argument('--exclude-ignored', action='store_true',
+                        help='(optional) Leave out outages whose alerts were ignored')
+    parser.add_argument('--top', type=int, default=20,
+                        help='(optional) Number of checks with the most downtime to print, '
+                             'default 20')
+    parser.add_argument('-o', '--output',
+                        help='(optional) CSV file to write the figures for every check to')
+    parser.add_argument('--fan-out', type=int, default=CONFIG['fan_out'],
+                        help='(optional) Number of pages to load at once, default {}'.format(
+                            CONFIG['fan_out']))
+
+    return parser.parse_args()
+
+
+def to_epoch(timestamps):
+    """Convert UTC API timestamps to seconds since the epoch, all at once."""
+    # The first 19 characters are the date and time to the second; API times are UTC.
+    return np.array([t[:19] for t in timestamps], dtype='datetime64[s]').astype(np.int64)
+
+
+def merge_intervals(keys, starts, ends):
+    """Merge the overlapping or touching intervals of each key.
+
+    One sort by (key, start), then a sweep: an interval opens a new run when it starts
+    after the furthest end seen so far for its key. Each key's times are shifted into
+    their own range first, so that a single running maximum never carries over from
+    one key to the next. Returns the merged (keys, starts, ends), sorted.
+    """
+    if not len(keys):
+        return keys, starts, ends
+    order = np.lexsort((starts, keys))
+    keys, starts, ends = keys[order], starts[order], ends[order]
+
+    base = starts.min()
+    span = int(ends.max() - base) + 1
+    offset = np.cumsum(np.r_[0, keys[1:] != keys[:-1]]) * span
+    furthest = np.maximum.accumulate(ends - base + offset)
+    opens = np.flatnonzero(np.r_[True, starts[1:] - base + offset[1:] > furthest[:-1]])
+    return keys[opens], starts[opens], np.maximum.reduceat(ends, opens)
+
+
+class DowntimeAccumulator:
+    """Outage counts, repair times and merged down intervals per check, built up from
+    pages of outages.
+
+    Outages are buffered as arrays and merged into the intervals so far every
+    `compact_rows` outages, so memory follows the number of separate down intervals
+    and checks rather than the number of outages read.
+    """
+
+    def __init__(self, now, exclude_ignored=False, compact_rows=CONFIG['compact_rows']):
+        self.now = now
+        self.exclude_ignored = exclude_ignored
+        self.compact_rows = compact_rows
+        self.names = {}
+        self.read = 0
+        self.buffer = []
+        self.buffered = 0
+        empty = np.empty(0, dtype=np.int64)
+        self.checks, self.starts, self.ends = empty, empty, empty
+        # Per check, sorted by pk.
+        self.pks, self.outages, self.repair_secs = empty, empty, empty
+
+    def add(self, outages):
+        """Add a page of outages."""
+        self.read += len(outages)
+        if self.exclude_ignored:
+            outages = [o for o in outages if not o['ignored']]
+        if not outages:
+            return
+        for o in outages:
+            if o['check_pk'] not in self.names:
+                self.names[o['check_pk']] = o['check_name']
+
+        starts = to_epoch([o['created_at'] for o in outages])
+        ends = np.full(len(outages), self.now, dtype=np.int64)
+        resolved = [i for i, o in enumerate(outages) if o['resolved_at']]
+        ends[resolved] = to_epoch([outages[i]['resolved_at'] for i in resolved])
+        checks = np.fromiter((o['check_pk'] for o in outages), dtype=np.int64,
+                             count=len(outages))
+        self.buffer.append((checks, starts, np.maximum(ends, starts)))
+        self.buffered += len(outages)
+        if self.buffered >= self.compact_rows:
+            self.compact()
+
+    def compact(self):
+        """Merge the buffered outages into the per-check totals and intervals."""
+        if not self.buffer:
+            return
+        checks, starts, ends = (np.concatenate(parts) for parts in zip(*self.buffer))
+        self.buffer = []
+        self.buffered = 0
+
+        self.pks, index = np.unique(np.r_[self.pks, checks], return_inverse=True)
+        self.outages = np.bincount(index, weights=np.r_[self.outages, np.ones(len(checks))]
+                                   ).astype(np.int64)
+        self.repair_secs = np.bincount(index, weights=np.r_[self.repair_secs, ends - starts]
+                                       ).astype(np.int64)
+
+        self.checks, self.starts, self.ends = merge_intervals(
+            np.r_[self.checks, checks], np.r_[self.starts, starts], np.r_[self.ends, ends])
+
+    def clipped(self, window_start, window_end):
+        """The merged intervals cut to the reporting window, dropping any outside it."""
+        self.compact()
+        starts = np.maximum(self.starts, window_start)
+        ends = np.minimum(self.ends, window_end)
+        keep = ends > starts
+        return self.checks[keep], starts[keep], ends[keep]
+
+
+def load_outages_page(page, page_size, start_date, end_date):
+    return CONFIG['client'].call('get', 'outages/',
+                                 params={'start_date': str(start_date),
+                                         'end_date': str(end_date),
+                                         'page': page, 'page_size': page_size},
+                                 label='Loading outages (page {})'.format(page),
+                                 fields=OUTAGE_FIELDS)
+
+
+def load_check_tags():
+    """Return {check pk: [tags]} for every check in the account."""
+    client = CONFIG['client']
+    page_size = client.page_size('checks/')
+    pages = PageFanOut(lambda page: client.call('get', 'checks/',
+                                                params={'page': page, 'page_size': page_size},
+                                                label='Loading checks (page {})'.format(page),
+                                                fields=CHECK_FIELDS),
+                       page_size, CONFIG['fan_out'])
+    tags = {}
+    for r in pages:
+        tags.update((c['pk'], c.get('tags') or []) for c in r['results'])
+    return tags
+
+
+def check_figures(acc, checks, starts, ends):
+    """Return per-check arrays of downtime seconds, aligned with acc.pks."""
+    rows = np.searchsorted(acc.pks, checks)
+    return np.bincount(rows, weights=ends - starts, minlength=len(acc.pks))
+
+
+def tag_figures(acc, check_tags, downtime, checks, starts, ends):
+    """Return [(tag, checks, outages, check downtime secs, union downtime secs,
+    repair secs)] for every tag with outages, with the whole account first.
+
+    A tag's union downtime counts the time any of its checks was down once, by
+    merging the intervals of all its checks.
+    """
+    tag_names = sorted({t for pk in acc.pks.tolist() for t in check_tags.get(pk) or [UNTAGGED]})
+    tag_ids = {t: i for i, t in enumerate(tag_names)}
+    # The tags of each check with outages, as flat arrays of (check row, tag id).
+    per_check = [[tag_ids[t] for t in check_tags.get(pk) or [UNTAGGED]]
+                 for pk in acc.pks.tolist()]
+    counts = np.fromiter(map(len, per_check), dtype=np.int64, count=len(per_check))
+    tag_rows = np.repeat(np.arange(len(per_check)), counts)
+    tag_of = np.fromiter((t for tags in per_check for t in tags), dtype=np.int64,
+                         count=int(counts.sum()))
+    first = np.cumsum(counts) - counts
+
+    def per_tag(values):
+        return np.bincount(tag_of, weights=values[tag_rows], minlength=len(tag_names))
+
+    # Give each interval one copy per tag of its check, then merge them per tag.
+    rows = np.searchsorted(acc.pks, checks)
+    copies = np.repeat(np.arange(len(rows)), counts[rows])
+    within = np.arange(len(copies)) - np.repeat(np.cumsum(counts[rows]) - counts[rows],
+                                                counts[rows])
+    interval_tags = tag_of[first[rows][copies] + within]
+    merged_tags, merged_starts, merged_ends = merge_intervals(
+        interval_tags, starts[copies], ends[copies])
+    union = np.bincount(merged_tags, weights=merged_ends - merged_starts,
+                        minlength=len(tag_names))
+    _, all_starts, all_ends = merge_intervals(np.zeros(len(checks), dtype=np.int64),
+                                              starts, ends)
+
+    figures = [('all', len(acc.pks), int(acc.outages.sum()), downtime.sum(),
+                (all_ends - all_starts).sum(), int(acc.repair_secs.sum()))]
+    figures.extend(zip(tag_names, np.bincount(tag_of, minlength=len(tag_names)).tolist(),
+                       per_tag(acc.outages).astype(np.int64).tolist(), per_tag(downtime),
+                       union, per_tag(acc.repair_secs)))
+    return figures
+
+
+def minutes(seconds):
+    return seconds / 60
+
+
+def main():
+    """Program entry point."""
+    opts = parse_args()
+    CONFIG['api'] = opts.api or CONFIG['api']
+    CONFIG['fan_out'] = max(1, opts.fan_out)
+    CONFIG['client'] = UptimeAPI(opts.token, CONFIG['api'], log_file=sys.stderr,
+                                 pool_size=CONFIG['fan_out'])
+    client = CONFIG['client']
+    from_date, to_date = getattr(opts, 'from'), opts.to
+    window_start = int(dt.datetime(from_date.year, from_date.month, from_date.day,
+                                   tzinfo=dt.timezone.utc).timestamp())
+    window_end = window_start + ((to_date - from_date).days + 1) * 86400
+
+    started = time.monotonic()
+    acc = DowntimeAccumulator(int(time.time()), exclude_ignored=opts.exclude_ignored)
+    page_size = client.page_size('outages/')
+    pages = PageFanOut(lambda page: load_outages_page(page, page_size, from_date, to_date),
+                       page_size, CONFIG['fan_out'])
+    for r in pages:
+        acc.add(r['results'])
+    if pages.shifted:
+        sys.stderr.write('Outages were added during the report, so some may be missing '
+                         'or counted twice.\n')
+    checks, starts, ends = acc.clipped(window_start, window_end)
+    downtime = check_figures(acc, checks, starts, ends)
+    check_tags = load_check_tags()
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mttr = acc.repair_secs / acc.outages
+
+    print('\n{} outages read, {} counted, for {} checks from {} to {} ({:.1f}s).'.format(
+        acc.read, int(acc.outages.sum()), len(acc.pks), from_date, to_date,
+        time.monotonic() - started))
+
+    print('\nTOP {} CHECKS BY DOWNTIME'.format(opts.top))
+    print('{:40s} {:>8} {:>12} {:>10}'.format('check', 'outages', 'down min', 'MTTR min'))
+    for i in np.argsort(-downtime, kind='stable')[:opts.top].tolist():
+        print('{:40s} {:>8} {:>12.1f} {:>10.1f}'.format(
+            str(acc.names.get(int(acc.pks[i]), acc.pks[i]))[:40], int(acc.outages[i]),
+            minutes(downtime[i]), minutes(mttr[i])))
+
+    print('\nBY TAG')
+    print('{:24s} {:>7} {:>8} {:>14} {:>12} {:>10}'.format(
+        'tag', 'checks', 'outages', 'check-down min', 'down min', 'MTTR min'))
+    for tag, n_checks, n_outages, check_down, union, repair in tag_figures(
+            acc, check_tags, downtime, checks, starts, ends):
+        print('{:24s} {:>7} {:>8} {:>14.1f} {:>12.1f} {:>10.1f}'.format(
+            tag[:24], n_checks, n_outages, minutes(check_down), minutes(union),
+            minutes(repair / n_outages) if n_outages else 0.0))
+
+    if opts.output:
+        with open(opts.output, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(('check_pk', 'name', 'tags', 'outages', 'downtime_minutes',
+                             'mttr_minutes'))
+            for i, pk in enumerate(acc.pks.tolist()):
+                writer.writerow((pk, acc.names.get(pk, ''), ','.join(check_tags.get(pk) or []),
+                                 int(acc.outages[i]), round(minutes(downtime[i]), 2),
+                                 round(minutes(mttr[i]), 2)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""An append-only journal of the progress of a bulk job, so that it can be resumed.
+
+The journal is a file of JSON lines: the job's parameters first, then one line for
+each operation begun or finished, each page cursor reached and each setting a
+resumed run must keep. Each line is handed to the OS as it is recorded, so a script
+that is killed loses nothing, but lines are only fsynced every SYNC_EVERY lines or
+SYNC_SECONDS, so keeping the journal costs next to nothing even at thousands of
+operations a minute. A machine crash can lose the last second or so of lines; the
+jobs only journal operations that are safe to repeat or can be looked up again (see
+the `begin` records of creates), so that just means a little work is redone.
+
+Resuming reads the journal back, ignoring a last line that was cut off mid-write,
+and refuses a journal written with other parameters.
+"""
+import json
+import os
+import threading
+import time
+
+SYNC_EVERY = 500
+SYNC_SECONDS = 1.0
+
+
+class Journal:
+    """Record the progress of a job in `path`.
+
+    With resume=True an existing journal for the same params is read back and
+    appended to: `finished` maps the keys of finished operations to their values,
+    `begun` does the same for operations that were started but may not have
+    finished, and `cursor` is the last page cursor recorded (None if there was none).
+    Otherwise the journal is started afresh. Keys, values and params must be
+    JSON values, and params a dict of the options that define the job.
+    """
+
+    def __init__(self, path, params, resume=False, sync_every=SYNC_EVERY,
+                 sync_seconds=SYNC_SECONDS):
+        self.path = path
+        self.params = params
+        self.sync_every = sync_every
+        self.sync_seconds = sync_seconds
+        self.lock = threading.Lock()
+        self.finished = {}
+        self.begun = {}
+        self.remembered = {}
+        self.cursor = None
+
+        if resume and os.path.exists(path):
+            end = self.read()
+            self.file = open(path, 'r+')
+            # Drop a line cut off by a crash so new lines start on a line of their own.
+            self.file.truncate(end)
+            self.file.seek(end)
+        else:
+            self.file = open(path, 'w')
+            self.write(['params', params])
+        self.unsynced = 0
+        self.sync()
+
+    def read(self):
+        """Load the journal and return the offset just past its last complete line."""
+        end = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    kind, *record = json.loads(line)
+                except ValueError:
+                    if line.endswith(b'\n'):
+                        raise SystemExit('{} is not a journal, or is corrupt.'.format(
+                            self.path))
+                    break
+                if kind == 'params':
+                    if record[0] != self.params:
+                        raise SystemExit(
+                            '{} was written by a run with other options ({}); run without '
+                            '--resume to start over.'.format(self.path, json.dumps(record[0])))
+                elif kind == 'begin':
+                    self.begun[record[0]] = record[1]
+                elif kind == 'finish':
+                    self.begun.pop(record[0], None)
+                    self.finished[record[0]] = record[1]
+                elif kind == 'cursor':
+                    self.cursor = record[0]
+                elif kind == 'remember':
+                    self.remembered[record[0]] = record[1]
+                end += len(line)
+        return end
+
+    def write(self, record):
+        self.file.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    def append(self, record):
+        """Write a record, syncing if enough have built up. Call with the lock held."""
+        self.write(record)
+        self.unsynced += 1
+        if (self.unsynced >= self.sync_every or
+                time.monotonic() - self.synced_at >= self.sync_seconds):
+            self._sync()
+        else:
+            self.file.flush()
+
+    def begin(self, key, value=None):
+        """Record that an operation is about to be sent, with what is needed to find
+        out later whether it took effect."""
+        with self.lock:
+            self.begun[key] = value
+            self.append(['begin', key, value])
+
+    def finish(self, key, value=None):
+        """Record that an operation has been done."""
+        with self.lock:
+            self.begun.pop(key, None)
+            self.finished[key] = value
+            self.append(['finish', key, value])
+
+    def set_cursor(self, cursor):
+        """Record that everything up to and including `cursor` has been done."""
+        with self.lock:
+            self.cursor = cursor
+            self.append(['cursor', cursor])
+
+    def remember(self, name, value):
+        """Return the value the job saved under `name`, saving `value` first if it has
+        none yet; for settings chosen at run time that a resumed run must keep."""
+        with self.lock:
+            if name not in self.remembered:
+                self.remembered[name] = value
+                self.append(['remember', name, value])
+            return self.remembered[name]
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+    def sync(self):
+        """Write everything recorded so far to disk."""
+        with self.lock:
+            self._sync()
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,52 @@
+"""JSON decoding for API responses.
+
+The fastest installed JSON library is used: orjson, then ujson, then the standard
+library. List responses can also be projected onto the few fields a caller keeps,
+so the rest of each item is dropped as soon as the page is decoded.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+def _stdlib_loads(data):
+    return json.loads(data)
+
+
+def _ujson_loads(data):
+    return ujson.loads(data)
+
+
+DECODERS = {'json': _stdlib_loads}
+if ujson is not None:
+    DECODERS['ujson'] = _ujson_loads
+if orjson is not None:
+    DECODERS['orjson'] = orjson.loads
+
+
+def get_decoder(name=None):
+    """Return the named decoder, or the fastest available one by default."""
+    if name:
+        if name not in DECODERS:
+            raise ValueError('JSON decoder {} is not installed; available: {}'.format(
+                name, ', '.join(sorted(DECODERS))))
+        return DECODERS[name]
+    for name in ('orjson', 'ujson', 'json'):
+        if name in DECODERS:
+            return DECODERS[name]
+
+
+def project(res, fields):
+    """Keep only the given fields of each item in a list response's `results`."""
+    if not isinstance(res, dict) or not isinstance(res.get('results'), list):
+        return res
+    res['results'] = [{f: item[f] for f in fields if f in item} for item in res['results']]
+    return res
@@ -0,0 +1,201 @@
+"""Per-endpoint metrics for the API calls made by a client.
+
+Every request is recorded against its method and endpoint template (`checks/{pk}/`,
+with ids replaced), including a latency histogram, status codes, retries, time spent
+waiting on the rate limiter and bytes sent and received. A summary table is printed
+to stderr when the script exits (set UPTIME_API_SUMMARY=0 to turn it off), and
+long-running scripts can write the metrics out as Prometheus text or JSON.
+"""
+import atexit
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+from collections import Counter
+from urllib.parse import urlsplit
+
+# Upper bounds in seconds of the latency histogram buckets; the last bucket is +Inf.
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PRINT_SUMMARY = os.environ.get('UPTIME_API_SUMMARY', '1') != '0'
+
+_ID_SEGMENT = re.compile(r'/\d+(?=/|$)')
+_WEBHOOK_TOKEN = re.compile(r'/webhook/[^/]+')
+
+
+def endpoint_template(url, api):
+    """The endpoint of a URL relative to the API root, with ids replaced by `{pk}`."""
+    path = url[len(api):] if url.startswith(api) else urlsplit(url).path
+    path = _WEBHOOK_TOKEN.sub('/webhook/{token}', '/' + path.split('?')[0])
+    return _ID_SEGMENT.sub('/{pk}', path).lstrip('/')
+
+
+class EndpointStats:
+    """Counters for one method and endpoint."""
+
+    __slots__ = ('requests', 'statuses', 'retries', 'wait_secs', 'bytes_out', 'bytes_in',
+                 'latency_sum', 'latency_max', 'buckets')
+
+    def __init__(self):
+        self.requests = 0
+        self.statuses = Counter()
+        self.retries = 0
+        self.wait_secs = 0.0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def percentile(self, q):
+        """The upper bound of the histogram bucket holding the q-th request."""
+        rank = q * self.requests
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.latency_max)
+        return self.latency_max
+
+    def errors(self):
+        return sum(n for status, n in self.statuses.items()
+                   if not isinstance(status, int) or status >= 400)
+
+
+class Metrics:
+    """Thread-safe per-endpoint request metrics, shared by a client and its
+    subaccount clients."""
+
+    def __init__(self, summary=PRINT_SUMMARY):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        if summary:
+            atexit.register(self.print_summary)
+
+    def record(self, method, endpoint, status, seconds, wait_secs=0.0, retries=0,
+               bytes_out=0, bytes_in=0):
+        """Record one call. status is the final HTTP status, or the name of the
+        exception raised when no response arrived."""
+        with self.lock:
+            stats = self.endpoints.get((method, endpoint))
+            if stats is None:
+                stats = self.endpoints[method, endpoint] = EndpointStats()
+            stats.requests += 1
+            stats.statuses[status] += 1
+            stats.retries += retries
+            stats.wait_secs += wait_secs
+            stats.bytes_out += bytes_out
+            stats.bytes_in += bytes_in
+            stats.latency_sum += seconds
+            stats.latency_max = max(stats.latency_max, seconds)
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    break
+            else:
+                i = len(LATENCY_BUCKETS)
+            stats.buckets[i] += 1
+
+    def snapshot(self):
+        """A sorted list of (method, endpoint, stats) copies."""
+        with self.lock:
+            items = sorted(self.endpoints.items())
+            copies = []
+            for (method, endpoint), stats in items:
+                copy = EndpointStats()
+                for name in EndpointStats.__slots__:
+                    value = getattr(stats, name)
+                    setattr(copy, name, value.copy() if hasattr(value, 'copy') else value)
+                copies.append((method, endpoint, copy))
+        return copies
+
+    def print_summary(self, out=None):
+        """Print a table of the calls made to each endpoint."""
+        rows = self.snapshot()
+        if not rows:
+            return
+        out = out or sys.stderr
+        out.write('\n{:6s} {:36s} {:>7} {:>6} {:>7} {:>8} {:>8} {:>8} {:>8} {:>9} {:>9}\n'.format(
+            'method', 'endpoint', 'calls', 'errors', 'retries', 'mean ms', 'p50 ms', 'p95 ms',
+            'max ms', 'wait s', 'KB in'))
+        for method, endpoint, s in rows:
+            out.write('{:6s} {:36s} {:>7} {:>6} {:>7} {:>8.0f} {:>8.0f} {:>8.0f} {:>8.0f} '
+                      '{:>9.1f} {:>9.1f}\n'.format(
+                          method.upper(), endpoint[:36], s.requests, s.errors(), s.retries,
+                          1000 * s.latency_sum / s.requests, 1000 * s.percentile(0.5),
+                          1000 * s.percentile(0.95), 1000 * s.latency_max, s.wait_secs,
+                          s.bytes_in / 1024))
+
+    def to_json(self):
+        return [{
+            'method': method.upper(),
+            'endpoint': endpoint,
+            'requests': s.requests,
+            'statuses': {str(k): v for k, v in s.statuses.items()},
+            'retries': s.retries,
+            'rate_limit_wait_seconds': round(s.wait_secs, 3),
+            'request_bytes': s.bytes_out,
+            'response_bytes': s.bytes_in,
+            'latency_seconds': {
+                'sum': round(s.latency_sum, 3),
+                'max': round(s.latency_max, 3),
+                'p50': s.percentile(0.5),
+                'p95': s.percentile(0.95),
+                'p99': s.percentile(0.99),
+                'buckets': dict(zip([str(b) for b in LATENCY_BUCKETS] + ['+Inf'], s.buckets)),
+            },
+        } for method, endpoint, s in self.snapshot()]
+
+    def to_prometheus(self):
+        """The metrics in the Prometheus text exposition format."""
+        rows = [((('method', m.upper()), ('endpoint', e)), s) for m, e, s in self.snapshot()]
+        lines = []
+
+        def header(name, kind, help_text):
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} {}'.format(name, kind))
+
+        def sample(name, labels, value):
+            lines.append('{}{{{}}} {}'.format(
+                name, ','.join('{}="{}"'.format(k, v) for k, v in labels), value))
+
+        header('uptime_api_requests_total', 'counter', 'API requests by final status.')
+        for labels, s in rows:
+            for status, n in sorted(s.statuses.items(), key=str):
+                sample('uptime_api_requests_total', labels + (('status', status),), n)
+
+        for name, help_text, attr in (
+                ('uptime_api_retries_total', 'Requests sent again after a failure.',
+                 'retries'),
+                ('uptime_api_rate_limit_wait_seconds_total',
+                 'Time spent waiting for the client rate limiter.', 'wait_secs'),
+                ('uptime_api_request_bytes_total', 'Request body bytes sent.', 'bytes_out'),
+                ('uptime_api_response_bytes_total', 'Response body bytes received.',
+                 'bytes_in')):
+            header(name, 'counter', help_text)
+            for labels, s in rows:
+                sample(name, labels, round(getattr(s, attr), 6))
+
+        name = 'uptime_api_request_duration_seconds'
+        header(name, 'histogram', 'API request latency, excluding rate limit waits.')
+        for labels, s in rows:
+            cumulative = 0
+            for bound, count in zip([str(b) for b in LATENCY_BUCKETS] + ['+Inf'], s.buckets):
+                cumulative += count
+                sample(name + '_bucket', labels + (('le', bound),), cumulative)
+            sample(name + '_sum', labels, round(s.latency_sum, 6))
+            sample(name + '_count', labels, s.requests)
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Write the metrics to a file, as JSON for a .json path and Prometheus text
+        otherwise. The file is replaced atomically, so readers never see half of it."""
+        if path.endswith('.json'):
+            text = json.dumps(self.to_json(), indent=2) + '\n'
+        else:
+            text = self.to_prometheus()
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.replace(tmp, path)
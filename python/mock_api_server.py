@@ -0,0 +1,580 @@
+#!/usr/bin/env python3
+import argparse
+import datetime as dt
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+API_PREFIX = '/api/v1/'
+MAX_PAGE_SIZE = 250
+
+# Synthetic checks cycle through these types and locations.
+CHECK_TYPES = ['HTTP', 'HTTP', 'HTTP', 'ICMP', 'DNS', 'TCP', 'SSL_CERT', 'API']
+LOCATIONS = [['US-East', 'US-West'], ['US-East', 'GBR'], ['AUT', 'DEU', 'GBR']]
+TAGS = [[], ['production'], ['staging'], ['production', 'web']]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Serve a local stand-in for the parts of the '
+                                                 'Uptime.com API used by these scripts.')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='(optional) Address to listen on, default 127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000,
+                        help='(optional) Port to listen on, default 8000')
+    parser.add_argument('--checks', type=int, default=1000,
+                        help='(optional) Number of synthetic checks, default 1000')
+    parser.add_argument('--sample-checks', type=int, default=10,
+                        help='(optional) How many of them are named "API Sample: ...", default 10')
+    parser.add_argument('--alerts', type=int, default=500,
+                        help='(optional) Number of synthetic alerts, default 500')
+    parser.add_argument('--outages', type=int, default=2000,
+                        help='(optional) Number of synthetic outages over the last 30 days, '
+                             'default 2000')
+    parser.add_argument('--alert-interval', type=float, default=0,
+                        help='(optional) Flip a random check and raise an alert every N seconds')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='(optional) Milliseconds added to every response')
+    parser.add_argument('--latency-per-item', type=float, default=0,
+                        help='(optional) Milliseconds added per item in list responses')
+    parser.add_argument('--jitter', type=float, default=0,
+                        help='(optional) Random milliseconds added on top of the latency')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='(optional) Requests per second allowed before answering 429')
+    parser.add_argument('--burst', type=int, default=10,
+                        help='(optional) Burst size for --rate, default 10')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='(optional) Fraction of requests answered with a 503')
+    parser.add_argument('--drop-rate', type=float, default=0,
+                        help='(optional) Fraction of requests whose connection is closed '
+                             'without a response')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='(optional) Random seed for the synthetic data')
+
+    return parser.parse_args()
+
+
+def iso(ts):
+    return dt.datetime.fromtimestamp(ts, dt.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def parse_day(value, default):
+    return dt.date.fromisoformat(value[:10]) if value else default
+
+
+class APIError(Exception):
+    def __init__(self, status, code, message, fields=None):
+        super().__init__(message)
+        self.status = status
+        self.body = {'messages': {'errors': True, 'error_code': code,
+                                  'error_message': message, 'error_fields': fields or {}}}
+
+
+class MockAccount:
+    """The synthetic data of one account.
+
+    Checks 1..N are generated on demand from their pk, and only checks that have been
+    created or changed are stored, so accounts of a million checks stay cheap.
+    """
+
+    def __init__(self, checks=1000, sample_checks=10, alerts=500, outages=2000, seed=0):
+        self.lock = threading.RLock()
+        self.seed = seed
+        self.base_count = checks
+        self.sample_checks = sample_checks
+        self.pks = array('q', range(1, checks + 1))
+        self.changed = {}
+        self.next_pk = checks + 1
+        self.search_cache = {}
+        self.now = time.time()
+
+        rnd = random.Random(seed)
+        self.alerts = []
+        for pk in range(1, alerts + 1):
+            self.alerts.append({
+                'pk': pk,
+                'check_pk': rnd.randint(1, max(1, checks)),
+                'state_is_up': rnd.random() < 0.5,
+                'created_at': iso(self.now - (alerts - pk) * 60),
+            })
+
+        self.outage_count = outages
+        self.outage_start = self.now - 30 * 86400
+        self.outage_step = 30 * 86400 / max(1, outages)
+        self.ignored = set()
+
+    # Checks
+
+    def base_name(self, pk):
+        if pk <= self.sample_checks:
+            return 'API Sample: Check {}'.format(pk)
+        return 'Check {:07d}'.format(pk)
+
+    def base_check(self, pk):
+        rnd = random.Random(self.seed * 1000003 + pk)
+        return {
+            'pk': pk,
+            'name': self.base_name(pk),
+            'check_type': CHECK_TYPES[pk % len(CHECK_TYPES)],
+            'contact_groups': ['Default'],
+            'locations': LOCATIONS[pk % len(LOCATIONS)],
+            'tags': TAGS[pk % len(TAGS)],
+            'msp_interval': 5,
+            'msp_address': 'https://example-{}.com'.format(pk),
+            'msp_notes': '',
+            'is_paused': rnd.random() < 0.05,
+            'state_is_up': rnd.random() > 0.02,
+            'state_changed_at': iso(self.now - rnd.randint(0, 90 * 86400)),
+        }
+
+    def get_check(self, pk):
+        if pk in self.changed:
+            return self.changed[pk]
+        if 1 <= pk <= self.base_count and self.has_pk(pk):
+            return self.base_check(pk)
+        raise APIError(404, 'NOT_FOUND', 'Not found.')
+
+    def has_pk(self, pk):
+        # New pks are always the highest, so self.pks stays sorted.
+        i = bisect_left(self.pks, pk)
+        return i < len(self.pks) and self.pks[i] == pk
+
+    def name(self, pk):
+        return self.changed[pk]['name'] if pk in self.changed else self.base_name(pk)
+
+    def touch(self):
+        self.search_cache.clear()
+
+    def list_checks(self, search=None):
+        """Return the pks of all checks, optionally filtered by name."""
+        if not search:
+            return self.pks
+        key = search.lower()
+        if key not in self.search_cache:
+            self.search_cache[key] = [pk for pk in self.pks if key in self.name(pk).lower()]
+        return self.search_cache[key]
+
+    def create_check(self, check_type, data):
+        if not data.get('name'):
+            raise APIError(400, 'VALIDATION_ERROR', 'Invalid data.', {'name': ['Required.']})
+        with self.lock:
+            pk = self.next_pk
+            self.next_pk += 1
+            check = {
+                'pk': pk,
+                'check_type': check_type,
+                'contact_groups': [],
+                'locations': [],
+                'tags': [],
+                'is_paused': False,
+                'state_is_up': True,
+                'state_changed_at': iso(time.time()),
+            }
+            check.update(data)
+            self.changed[pk] = check
+            self.pks.append(pk)
+            self.touch()
+            return check
+
+    def update_check(self, pk, data):
+        with self.lock:
+            check = dict(self.get_check(pk))
+            check.update(data)
+            check['pk'] = pk
+            self.changed[pk] = check
+            self.touch()
+            return check
+
+    def delete_check(self, pk):
+        with self.lock:
+            self.get_check(pk)
+            self.changed.pop(pk, None)
+            self.pks = array('q', (p for p in self.pks if p != pk))
+            self.touch()
+
+    def set_state(self, pk, state_is_up):
+        with self.lock:
+            check = self.update_check(pk, {'state_is_up': state_is_up,
+                                           'state_changed_at': iso(time.time())})
+            self.alerts.append({
+                'pk': len(self.alerts) + 1,
+                'check_pk': pk,
+                'state_is_up': state_is_up,
+                'created_at': check['state_changed_at'],
+            })
+            return check
+
+    def flip_random_check(self):
+        with self.lock:
+            if self.pks:
+                pk = random.choice(self.pks)
+                self.set_state(pk, not self.get_check(pk)['state_is_up'])
+
+    # Stats
+
+    def check_stats(self, pk, start, end, include_alerts):
+        statistics = []
+        alerts = []
+        day = start
+        while day <= end:
+            # Seeded per check and day, so a day's stats do not depend on the range asked for.
+            rnd = random.Random(hash((self.seed, pk, day.toordinal())))
+            outages = 1 if rnd.random() < 0.05 else 0
+            downtime = rnd.randint(60, 3600) if outages else 0
+            statistics.append({
+                'date': str(day),
+                'outages': outages,
+                'downtime_secs': downtime,
+                'uptime': round(100.0 * (1 - downtime / 86400), 4),
+                'response_time': round(rnd.uniform(0.05, 2.0), 3),
+            })
+            if outages:
+                alerts.append({'pk': pk * 100000 + day.toordinal() % 100000,
+                               'state_is_up': False, 'created_at': str(day) + 'T12:00:00Z'})
+            day += dt.timedelta(days=1)
+
+        downtime = sum(s['downtime_secs'] for s in statistics)
+        # Uptime is over the time that has passed, so today only counts in part.
+        period = (min(dt.datetime.utcnow(), dt.datetime.combine(day, dt.time())) -
+                  dt.datetime.combine(start, dt.time())).total_seconds()
+        stats = {
+            'pk': pk,
+            'statistics': statistics,
+            'totals': {
+                'outages': sum(s['outages'] for s in statistics),
+                'downtime_secs': downtime,
+                'uptime': round(100.0 * max(0.0, 1 - downtime / period), 4) if period > 0
+                else 100.0,
+            },
+        }
+        if include_alerts:
+            stats['alerts'] = alerts
+        return stats
+
+    # Outages
+
+    def outage(self, pk, base_url):
+        check_pk = self.pks[pk % len(self.pks)] if self.pks else pk
+        created = self.outage_start + (pk - 1) * self.outage_step
+        return {
+            'pk': pk,
+            'check_pk': check_pk,
+            'check_name': self.name(check_pk) if self.pks else 'Deleted',
+            'created_at': iso(created),
+            'resolved_at': iso(created + 60 + pk % 3600),
+            'duration_secs': 60 + pk % 3600,
+            'ignored': pk in self.ignored,
+            'ignore_alert_url': '{}outages/{}/ignore/'.format(base_url, pk),
+        }
+
+    def outage_range(self, start_date, end_date):
+        """The first and last outage pks created between two days, inclusive."""
+        start = dt.datetime.combine(start_date, dt.time(), dt.timezone.utc).timestamp()
+        end = dt.datetime.combine(end_date + dt.timedelta(days=1), dt.time(),
+                                  dt.timezone.utc).timestamp()
+        first = max(1, int((start - self.outage_start) // self.outage_step) + 1)
+        last = min(self.outage_count, int((end - self.outage_start) // self.outage_step))
+        while first <= last and self.outage_start + (first - 1) * self.outage_step < start:
+            first += 1
+        return first, last
+
+
+class MockAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'MockUptimeAPI/1.0'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    # Plumbing
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PATCH(self):
+        self.handle_request('PATCH')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+    def handle_request(self, method):
+        server = self.server
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        url = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        self.extra_headers = {}
+        server.record_request(length)
+
+        if url.path.startswith('/__'):
+            return self.send_json(200, server.control(url.path, method))
+
+        if server.rnd.random() < server.drop_rate:
+            self.close_connection = True
+            try:
+                self.connection.shutdown(2)
+            except OSError:
+                pass
+            return
+        if not server.take_token(self.extra_headers):
+            return self.send_json(429, {'detail': 'Request was throttled.'})
+        if server.rnd.random() < server.error_rate:
+            return self.send_json(503, {'detail': 'Service unavailable (injected).'})
+
+        try:
+            body = json.loads(raw) if raw else {}
+            status, result, items = self.route(method, url.path, query, body)
+        except APIError as e:
+            status, result, items = e.status, e.body, 0
+        except (ValueError, KeyError) as e:
+            status, result, items = 400, APIError(400, 'BAD_REQUEST', str(e)).body, 0
+
+        delay = server.latency + server.latency_per_item * items
+        if server.jitter:
+            delay += server.rnd.random() * server.jitter
+        if delay:
+            time.sleep(delay / 1000)
+        self.send_json(status, result)
+
+    def send_json(self, status, result):
+        payload = b'' if result is None else json.dumps(result).encode()
+        etag = None
+        if status == 200 and self.command == 'GET':
+            etag = '"{}"'.format(hashlib.md5(payload).hexdigest())
+            if self.headers.get('If-None-Match') == etag:
+                status, payload = 304, b''
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        if etag:
+            self.send_header('ETag', etag)
+        for name, value in self.extra_headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+        self.server.record_response(len(payload))
+
+    def base_url(self):
+        return 'http://{}{}'.format(self.headers.get('Host'), API_PREFIX)
+
+    def paginate(self, items, query, path, render):
+        page = int(query.get('page', 1))
+        page_size = min(MAX_PAGE_SIZE, max(1, int(query.get('page_size', 25))))
+        start = (page - 1) * page_size
+        if page < 1 or (start >= len(items) and page > 1):
+            raise APIError(404, 'NOT_FOUND', 'Invalid page.')
+        results = [render(item) for item in items[start:start + page_size]]
+        nxt = None
+        if start + page_size < len(items):
+            nxt = '{}{}?page={}&page_size={}'.format(self.base_url(), path, page + 1, page_size)
+        return {'count': len(items), 'next': nxt,
+                'previous': None if page == 1 else 'page={}'.format(page - 1),
+                'results': results}
+
+    # Routes
+
+    def route(self, method, path, query, body):
+        account = self.server.account
+        m = re.match(r'^/metrics/webhook/([\w-]+)/?$', path)
+        if m and method == 'POST':
+            self.server.webhooks[m.group(1)] = body.get('state_is_up')
+            return 200, {'messages': {'errors': False}}, 0
+
+        if not path.startswith(API_PREFIX):
+            raise APIError(404, 'NOT_FOUND', 'Not found.')
+        if not self.headers.get('Authorization'):
+            raise APIError(401, 'AUTHENTICATION_FAILED', 'Authentication credentials were '
+                                                         'not provided.')
+        path = path[len(API_PREFIX):]
+        ok = {'messages': {'errors': False}}
+
+        with account.lock:
+            if path == 'checks/' and method == 'GET':
+                pks = account.list_checks(query.get('search'))
+                r = self.paginate(pks, query, path, account.get_check)
+                return 200, r, len(r['results'])
+
+            if path == 'checks/bulk/stats/' and method == 'GET':
+                today = dt.datetime.utcnow().date()
+                start = parse_day(query.get('start_date'), today - dt.timedelta(days=30))
+                end = parse_day(query.get('end_date'), today)
+                pks = [int(pk) for pk in query.get('pk', '').split(',') if pk]
+                checks = [account.check_stats(pk, start, end, query.get('include_alerts') == '1')
+                          for pk in pks if pk in account.changed or account.has_pk(pk)]
+                return 200, {'checks': checks}, len(checks)
+
+            m = re.match(r'^checks/add-([\w-]+)/$', path)
+            if m and method == 'POST':
+                check = account.create_check(m.group(1).upper().replace('-', '_'), body)
+                return 200, dict(ok, results=check), 1
+
+            m = re.match(r'^checks/(\d+)/(?:([\w-]+)/)?$', path)
+            if m:
+                pk, action = int(m.group(1)), m.group(2)
+                if action is None and method == 'GET':
+                    return 200, account.get_check(pk), 1
+                if action is None and method in ('PATCH', 'PUT'):
+                    return 200, dict(ok, results=account.update_check(pk, body)), 1
+                if action is None and method == 'DELETE':
+                    account.delete_check(pk)
+                    return 200, ok, 1
+                if action in ('pause', 'resume') and method == 'POST':
+                    check = account.update_check(pk, {'is_paused': action == 'pause'})
+                    return 200, dict(ok, results=check), 1
+                replace = {'replace-tags': 'tags', 'replace-locations': 'locations',
+                           'replace-contact-groups': 'contact_groups'}
+                if action in replace and method in ('PATCH', 'PUT', 'POST'):
+                    field = replace[action]
+                    check = account.update_check(pk, {field: body.get(field, [])})
+                    return 200, dict(ok, results=check), 1
+
+            if path == 'check-tags/' and method == 'POST':
+                return 200, dict(ok, results=body), 1
+
+            if path == 'alerts/' and method == 'GET':
+                alerts = account.alerts
+                if query.get('start_date'):
+                    since = query['start_date'].replace('+00:00', '')
+                    alerts = [a for a in alerts if a['created_at'] >= since]
+                if query.get('ordering') == '-pk':
+                    alerts = alerts[::-1]
+                r = self.paginate(alerts, query, path, dict)
+                return 200, r, len(r['results'])
+
+            if path == 'outages/' and method == 'GET':
+                today = dt.datetime.utcnow().date()
+                first, last = account.outage_range(
+                    parse_day(query.get('start_date'), today - dt.timedelta(days=30)),
+                    parse_day(query.get('end_date'), today))
+                base_url = self.base_url()
+                r = self.paginate(range(first, last + 1), query, path,
+                                  lambda pk: account.outage(pk, base_url))
+                return 200, r, len(r['results'])
+
+            m = re.match(r'^outages/(\d+)/ignore/$', path)
+            if m and method == 'POST':
+                account.ignored.add(int(m.group(1)))
+                return 200, ok, 1
+
+        raise APIError(404, 'NOT_FOUND', 'Not found.')
+
+
+class MockAPIServer(ThreadingHTTPServer):
+    """An HTTP server holding one synthetic account plus the fault settings."""
+    daemon_threads = True
+
+    def __init__(self, address, account, latency=0, latency_per_item=0, jitter=0, rate=0,
+                 burst=10, error_rate=0, drop_rate=0, verbose=False):
+        super().__init__(address, MockAPIHandler)
+        self.account = account
+        self.latency = latency
+        self.latency_per_item = latency_per_item
+        self.jitter = jitter
+        self.rate = rate
+        self.burst = burst
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.verbose = verbose
+        self.rnd = random.Random()
+        self.webhooks = {}
+        self.counter_lock = threading.Lock()
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.reset_counters()
+
+    @property
+    def api_url(self):
+        host, port = self.server_address[:2]
+        return 'http://{}:{}{}'.format(host, port, API_PREFIX)
+
+    def reset_counters(self):
+        with self.counter_lock:
+            self.counters = {'requests': 0, 'bytes_in': 0, 'bytes_out': 0, 'throttled': 0}
+
+    def record_request(self, length):
+        with self.counter_lock:
+            self.counters['requests'] += 1
+            self.counters['bytes_in'] += length
+
+    def record_response(self, length):
+        with self.counter_lock:
+            self.counters['bytes_out'] += length
+
+    def take_token(self, headers):
+        """Apply the --rate limit, filling in the rate limit headers."""
+        if not self.rate:
+            return True
+        with self.counter_lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            allowed = self.tokens >= 1
+            if allowed:
+                self.tokens -= 1
+            else:
+                self.counters['throttled'] += 1
+            reset = (self.burst - self.tokens) / self.rate
+            headers['X-RateLimit-Limit'] = str(self.burst)
+            headers['X-RateLimit-Remaining'] = str(int(self.tokens))
+            headers['X-RateLimit-Reset'] = '{:.3f}'.format(reset)
+            if not allowed:
+                headers['Retry-After'] = '{:.3f}'.format((1 - self.tokens) / self.rate)
+            return allowed
+
+    def control(self, path, method):
+        """Endpoints for benchmarks: /__stats__ returns the counters, /__reset__ clears them."""
+        if path.startswith('/__reset__'):
+            self.reset_counters()
+        with self.counter_lock:
+            return dict(self.counters)
+
+
+def start_server(port=0, host='127.0.0.1', checks=1000, sample_checks=10, alerts=500,
+                 outages=2000, seed=0, **options):
+    """Start a server in a background thread and return it; its API is at server.api_url."""
+    account = MockAccount(checks, sample_checks, alerts, outages, seed)
+    server = MockAPIServer((host, port), account, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    """Program entry point."""
+    opts = parse_args()
+    account = MockAccount(opts.checks, opts.sample_checks, opts.alerts, opts.outages, opts.seed)
+    server = MockAPIServer((opts.host, opts.port), account, latency=opts.latency,
+                           latency_per_item=opts.latency_per_item, jitter=opts.jitter,
+                           rate=opts.rate, burst=opts.burst, error_rate=opts.error_rate,
+                           drop_rate=opts.drop_rate, verbose=True)
+    print('Serving a mock Uptime.com API at {}'.format(server.api_url))
+    print('Use it with: --token anything --api {}'.format(server.api_url))
+
+    if opts.alert_interval:
+        def raise_alerts():
+            while True:
+                time.sleep(opts.alert_interval)
+                account.flip_random_check()
+        threading.Thread(target=raise_alerts, daemon=True).start()
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,31 @@
 #!/usr/bin/env python3
 import argparse
+import asyncio
 import datetime as dt
+import sys
 import time
-from urllib.parse import urlencode
+from bisect import bisect_left, insort
 
 import requests
 
+from pagination import PageFanOut
+from rate_limit import DEFAULT_RATES
+from uptime_api import APIError, UptimeAPI
+
 CONFIG = {
     'api': 'https://uptime.com/api/v1/',
-    'token': '',
-    'headers': {},
-    'page_size': 250,
+    'client': None,
+    # Polls between full reloads of all checks.
+    'reload_interval': 15,
+    # Seconds between polls, and how many polls to make before exiting (None for no limit).
+    'interval': 60,
+    'ticks': None,
+    # Pages of checks loaded at once, and how many times a listing is read when checks
+    # shift between pages while it is being read.
+    'fan_out': 4,
+    'listing_attempts': 3,
+    # File the API call metrics are written to after each poll, if any.
+    'metrics_file': None,
 }
 
 
@@ -22,127 +37,447 @@ def parse_args():
     parser.add_argument('--api',
                         help='(optional) The Uptime.com API endpoint to use, eg. '
                              'https://uptime.com/api/v1/')
+    parser.add_argument('--subaccounts',
+                        help='(optional) Comma separated list of subaccounts to watch together '
+                             'from one process instead of the main account')
+    parser.add_argument('--interval', type=float, default=CONFIG['interval'],
+                        help='(optional) Seconds between polls, default {}'.format(
+                            CONFIG['interval']))
+    parser.add_argument('--ticks', type=int,
+                        help='(optional) Exit after this many polls, eg. for benchmarking')
+    parser.add_argument('--metrics-file',
+                        help='(optional) File to write per-endpoint API call metrics to after '
+                             'each poll, as JSON if it ends in .json and in the Prometheus '
+                             'text format otherwise (eg. for the node_exporter textfile '
+                             'collector)')
+    parser.add_argument('--read-rate', type=float,
+                        help='(optional) Read requests per second to allow, default {:g} at '
+                             'first, rising to {:g} while the API keeps up. Raise it to let '
+                             'pages load concurrently'.format(DEFAULT_RATES['read'][0],
+                                                              DEFAULT_RATES['read'][2]))
 
     return parser.parse_args()
 
 
-def make_api_call(label, method, endpoint, pk=None, params=None, json=None):
-    """Make an Uptime.com API call with the given method, endpoint and parameters."""
-    url = CONFIG['api'] + endpoint.format(pk=pk)
-    qs = '?' + urlencode(params) if params else ''
-    print('{} - {} {}{}'.format(label, method.upper(), url, qs))
+def parse_timestamp(value):
+    """Convert an API timestamp to seconds since the epoch."""
+    if not value:
+        return None
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    return int(dt.datetime.fromisoformat(value).timestamp())
 
-    r = requests.request(method, url, params=params, json=json, headers=CONFIG['headers'])
-    r.raise_for_status()
-    return r.json()
 
+def format_timestamp(value):
+    if value is None:
+        return 'unknown'
+    return dt.datetime.fromtimestamp(value, dt.timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
 
-def load_all_checks():
-    """Load all checks in the account, spanning multiple pages of results if necessary."""
-    page = 1
-    all_checks = []
-    while True:
-        r = make_api_call('Loading checks (page {})'.format(page),
-                          'get', 'checks/',
-                          params={'page': page, 'page_size': CONFIG['page_size']})
-        all_checks.extend(r['results'])
-        if not r['next']:
-            break
-        else:
-            page += 1
 
-    return {c['pk']: {
-        'pk': c['pk'],
-        'name': c['name'],
-        'is_paused': c['is_paused'],
-        'state_is_up': c['state_is_up'],
-        'state_changed_at': c['state_changed_at'],
-    } for c in all_checks}
+# The fields of the checks/ and alerts/ results that the monitor uses.
+CHECK_FIELDS = ('pk', 'name', 'is_paused', 'state_is_up', 'state_changed_at')
+ALERT_FIELDS = ('pk', 'check_pk', 'state_is_up', 'created_at')
 
 
-def load_alerts_from_date(from_date):
-    """Load all new alerts raised after the given date, spanning multiple pages if necessary."""
-    page = 1
-    all_alerts = []
-    while True:
-        r = make_api_call('Loading alerts since {} (page {})'.format(from_date, page),
-                          'get', 'alerts/',
-                          params={'ordering': '-pk', 'start_date': from_date.isoformat(),
-                                  'page_size': CONFIG['page_size']})
-        all_alerts.extend(r['results'])
-        if len(r['results']) < CONFIG['page_size']:
+class CheckState:
+    """The fields of a check that the monitor keeps track of.
+
+    Instances use __slots__, interned names and integer timestamps to keep the
+    per-check overhead small. They are never changed once created, so the same
+    objects can be shared between the current state and the page cache.
+    """
+    __slots__ = ('pk', 'name', 'is_paused', 'state_is_up', 'state_changed_at')
+
+    def __init__(self, pk, name, is_paused, state_is_up, state_changed_at):
+        self.pk = pk
+        self.name = name
+        self.is_paused = is_paused
+        self.state_is_up = state_is_up
+        self.state_changed_at = state_changed_at
+
+    def __eq__(self, other):
+        if not isinstance(other, CheckState):
+            return NotImplemented
+        return all(getattr(self, f) == getattr(other, f) for f in self.__slots__)
+
+    def with_state(self, state_is_up, state_changed_at):
+        return CheckState(self.pk, self.name, self.is_paused, state_is_up, state_changed_at)
+
+
+def check_state(c):
+    """Build the monitor's state for a check from its API representation."""
+    return CheckState(c['pk'], sys.intern(c['name']), c['is_paused'], c['state_is_up'],
+                      parse_timestamp(c['state_changed_at']))
+
+
+def load_checks_page(client, page, page_size, cached=None):
+    """Load one page of checks. If the page was loaded before it is requested
+    conditionally, and the cached copy is returned when the server reports it unchanged."""
+    headers = {}
+    if cached and cached['etag']:
+        headers['If-None-Match'] = cached['etag']
+    if cached and cached['last_modified']:
+        headers['If-Modified-Since'] = cached['last_modified']
+
+    r = client.request('get', 'checks/',
+                       params={'page': page, 'page_size': page_size},
+                       headers=headers,
+                       label='Loading checks (page {})'.format(page))
+    if r.status_code == 304 and cached:
+        return cached, True
+
+    res = client.unwrap(r, fields=CHECK_FIELDS)
+    return {
+        'etag': r.headers.get('ETag'),
+        'last_modified': r.headers.get('Last-Modified'),
+        'count': res['count'],
+        'next': res['next'],
+        'bytes': len(r.content),
+        'checks': [check_state(c) for c in res['results']],
+    }, False
+
+
+def load_all_checks(client, page_cache=None):
+    """Load all checks in the account, spanning multiple pages of results if necessary.
+
+    The pages after the first are loaded concurrently. If checks are added or removed
+    while they load, so that some may have been missed, the listing is read again.
+
+    Pass a dict as page_cache to keep the pages between calls and request them
+    conditionally. Also returns the number of pages and bytes that did not have to
+    be downloaded again.
+    """
+    # Pages are cached by size too, as the size may be retuned between calls.
+    page_size = client.page_size('checks/')
+
+    def cached_page(page):
+        return page_cache.get((page_size, page)) if page_cache is not None else None
+
+    def load_page(page):
+        return load_checks_page(client, page, page_size, cached_page(page))[0]
+
+    for attempt in range(1, CONFIG['listing_attempts'] + 1):
+        all_checks = {}
+        saved = {'pages': 0, 'bytes': 0}
+        pages = PageFanOut(load_page, page_size, CONFIG['fan_out'])
+        duplicates = False
+        for page, r in enumerate(pages, 1):
+            # An unchanged page is the cached copy itself.
+            if r is cached_page(page):
+                saved['pages'] += 1
+                saved['bytes'] += r['bytes']
+            elif page_cache is not None:
+                page_cache[page_size, page] = r
+
+            before = len(all_checks)
+            all_checks.update((c.pk, c) for c in r['checks'])
+            duplicates = duplicates or len(all_checks) - before < len(r['checks'])
+
+        if not (pages.shifted or duplicates) or attempt == CONFIG['listing_attempts']:
             break
-        else:
-            page += 1
+        print('Checks were added or removed while loading them, reading them again...')
+
+    # Forget pages past the end, in case the account has fewer checks than before,
+    # and pages of another size.
+    if page_cache is not None:
+        for stale in [k for k in page_cache if k[0] != page_size or k[1] > page]:
+            del page_cache[stale]
+
+    return all_checks, saved
+
+
+class DownIndex:
+    """The down checks, kept sorted by name as their state changes.
+
+    Each update is a binary search plus an insert into a list that only holds the down
+    checks, so keeping it current never touches the checks that are up.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.keys = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return (pk for _, pk in self.entries)
+
+    def discard(self, pk):
+        key = self.keys.pop(pk, None)
+        if key is not None:
+            del self.entries[bisect_left(self.entries, key)]
+
+    def update(self, check):
+        """Add, move or remove a check after its name or state may have changed."""
+        self.discard(check.pk)
+        if not check.state_is_up:
+            key = (check.name, check.pk)
+            insort(self.entries, key)
+            self.keys[check.pk] = key
+
+
+def reconcile_checks(client, all_checks, page_cache, down_index):
+    """Reload all checks and apply only the added, removed and changed ones to all_checks."""
+    latest, saved = load_all_checks(client, page_cache)
 
-    # Reverse the list so earlier alerts come first, to be overwritten by later ones.
-    return list(reversed([{
-        'check_pk': a['check_pk'],
-        'state_is_up': a['state_is_up'],
-        'state_changed_at': a['created_at'],
-    } for a in all_alerts]))
+    added = latest.keys() - all_checks.keys()
+    removed = all_checks.keys() - latest.keys()
+    changed = [pk for pk in latest.keys() & all_checks.keys() if latest[pk] != all_checks[pk]]
+    # Checks leave the index before the dict, so that a display running in another
+    # thread never finds a down check that is no longer there.
+    for pk in removed:
+        down_index.discard(pk)
+        del all_checks[pk]
+    for pk in added:
+        all_checks[pk] = latest[pk]
+        down_index.update(all_checks[pk])
+    for pk in changed:
+        all_checks[pk] = latest[pk]
+        down_index.update(all_checks[pk])
 
+    print('Reconciled checks: {} added, {} removed, {} changed; {} of {} pages unchanged, '
+          '{:.1f} KB not downloaded again.'.format(
+              len(added), len(removed), len(changed), saved['pages'], len(page_cache),
+              saved['bytes'] / 1024))
 
-def merge_alerts_into_check_status(all_checks, new_alerts):
+
+class AlertSync:
+    """Pull new alerts using the highest alert pk seen so far as a cursor.
+
+    Alerts are listed newest first, so each poll reads pages only until it reaches an
+    alert it has already seen; normally that is a single request. Alerts are keyed by
+    pk, so ones that shift between pages while they are being read are merged once.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.last_pk = None
+
+    def start(self):
+        """Set the cursor to the newest existing alert, so only later ones are reported."""
+        r = self.client.call('get', 'alerts/',
+                             params={'ordering': '-pk', 'page_size': 1},
+                             label='Loading latest alert')
+        self.last_pk = r['results'][0]['pk'] if r['results'] else 0
+
+    def poll(self):
+        """Load the alerts raised since the last poll, oldest first."""
+        page = 1
+        page_size = self.client.page_size('alerts/')
+        new_alerts = {}
+        while True:
+            r = self.client.call('get', 'alerts/',
+                                 params={'ordering': '-pk', 'page': page,
+                                         'page_size': page_size},
+                                 label='Loading alerts after #{} (page {})'.format(
+                                     self.last_pk, page),
+                                 fields=ALERT_FIELDS)
+            fresh = [a for a in r['results'] if a['pk'] > self.last_pk]
+            new_alerts.update((a['pk'], a) for a in fresh)
+            if len(fresh) < len(r['results']) or not r['next']:
+                break
+            else:
+                page += 1
+
+        # Only move the cursor once the whole batch has been read.
+        if new_alerts:
+            self.last_pk = max(new_alerts)
+
+        # Earlier alerts come first, to be overwritten by later ones.
+        return [{
+            'check_pk': a['check_pk'],
+            'state_is_up': a['state_is_up'],
+            'state_changed_at': parse_timestamp(a['created_at']),
+        } for _, a in sorted(new_alerts.items())]
+
+
+def merge_alerts_into_check_status(all_checks, new_alerts, down_index):
     for alert in new_alerts:
-        check = all_checks[alert['check_pk']]
-        check['state_is_up'] = alert['state_is_up']
-        check['state_changed_at'] = alert['state_changed_at']
+        check = all_checks.get(alert['check_pk'])
+        if check is None:
+            # A check created since the last reload; it is picked up by the next one.
+            continue
+        check = all_checks[check.pk] = check.with_state(alert['state_is_up'],
+                                                        alert['state_changed_at'])
+        down_index.update(check)
 
         print('NEW ALERT: {} - {} at {}'.format(
-            check['name'],
-            'UP' if check['state_is_up'] else 'DOWN',
-            check['state_changed_at']))
+            check.name,
+            'UP' if check.state_is_up else 'DOWN',
+            format_timestamp(check.state_changed_at)))
 
 
-def display_check_status(checks):
-    """Print out the status of all down checks."""
-    down = sorted((c for c in checks.values() if not c['state_is_up']),
-                  key=lambda x: x['name'])
+def display_check_status(checks, down_index, title='CHECK STATUS', error=None):
+    """Print out the status of all down checks, and the last error polling them."""
 
     print('')
-    print('------------')
-    print('CHECK STATUS')
-    print('------------')
+    print('-' * len(title))
+    print(title)
+    print('-' * len(title))
+    if error is not None:
+        print('FAILED: {}'.format(error))
     print('{} total checks.'.format(len(checks)))
 
+    # A snapshot, as the subaccount monitors update the checks from worker threads.
+    down = [checks.get(pk) for pk in list(down_index)]
+    down = [check for check in down if check is not None]
     if not down:
         print('No checks are currently down.\n')
         return
 
     for check in down:
-        print('{:40s} - DOWN since {}'.format(check['name'], check['state_changed_at']))
+        print('{:40s} - DOWN since {}'.format(check.name,
+                                              format_timestamp(check.state_changed_at)))
     print('')
 
 
+class AccountMonitor:
+    """The checks, alerts and down checks being watched in one account."""
+
+    def __init__(self, client, title='CHECK STATUS'):
+        self.client = client
+        self.title = title
+        self.all_checks = {}
+        self.page_cache = {}
+        self.down_index = DownIndex()
+        self.alert_sync = AlertSync(client)
+        self.started = False
+        self.reload_pending = False
+        # Why the last poll failed, or None.
+        self.error = None
+
+    def fail(self, message, e):
+        self.error = '{} ({})'.format(message, e)
+        print('{}: {}'.format(self.title, self.error))
+
+    def start(self):
+        """Set the alert cursor, returning whether that worked."""
+        try:
+            self.alert_sync.start()
+        except (APIError, requests.RequestException) as e:
+            self.fail('could not be loaded, trying again at the next reload', e)
+            return False
+        self.started = True
+        return True
+
+    def tick(self, minutes_elapsed):
+        """Poll the account. A poll that still fails after the client's retries is
+        reported and skipped, and a failed reload is tried again at the next poll. An
+        account that could not be started is tried again at the next reload."""
+        reload = self.reload_pending or minutes_elapsed % CONFIG['reload_interval'] == 0
+        if not self.started and not (reload and self.start()):
+            return
+        try:
+            if reload:
+                # Reload all checks, loading new checks etc., on the first poll, every
+                # `reload_interval` polls after it and the poll after a failed reload.
+                self.reload_pending = True
+                reconcile_checks(self.client, self.all_checks, self.page_cache,
+                                 self.down_index)
+                self.reload_pending = False
+            else:
+                # Otherwise check for new alerts and update the checks statuses.
+                new_alerts = self.alert_sync.poll()
+                merge_alerts_into_check_status(self.all_checks, new_alerts, self.down_index)
+        except (APIError, requests.RequestException) as e:
+            self.fail('poll failed, trying again at the next one', e)
+        else:
+            self.error = None
+
+    def display(self):
+        display_check_status(self.all_checks, self.down_index, self.title, self.error)
+
+
+async def watch_account(monitor, offset, reload_offset):
+    """Poll one account every interval, starting `offset` seconds in so that accounts
+    take turns instead of all polling at once."""
+    await asyncio.sleep(offset)
+    minutes_elapsed = 0
+    ticks = 0
+    while CONFIG['ticks'] is None or ticks < CONFIG['ticks']:
+        started = time.monotonic()
+        await asyncio.to_thread(monitor.tick, minutes_elapsed)
+        ticks += 1
+        # After the initial load, move each account to a different point of the reload
+        # cycle, so that the full reloads of different accounts fall on different minutes.
+        minutes_elapsed = (minutes_elapsed or reload_offset) + 1
+        await asyncio.sleep(max(0.0, CONFIG['interval'] - (time.monotonic() - started)))
+
+
+def write_metrics():
+    if CONFIG['metrics_file']:
+        CONFIG['client'].metrics.write(CONFIG['metrics_file'])
+
+
+def display_accounts(monitors):
+    """Print a merged status view for all accounts."""
+    write_metrics()
+    total = sum(len(m.all_checks) for m in monitors)
+    down = sum(len(m.down_index) for m in monitors)
+    failed = sum(m.error is not None for m in monitors)
+    print('\n{} total checks in {} accounts, {} down{}.'.format(
+        total, len(monitors), down, ', {} failing'.format(failed) if failed else ''))
+    for monitor in monitors:
+        monitor.display()
+
+
+async def keep_displaying_accounts(monitors):
+    """Print the merged status view once every interval."""
+    while True:
+        await asyncio.sleep(CONFIG['interval'])
+        display_accounts(monitors)
+
+
+async def watch_subaccounts(subaccounts):
+    """Watch several subaccounts from one process, sharing one connection pool and one
+    rate limit budget between them."""
+    monitors = [AccountMonitor(CONFIG['client'].for_subaccount(subaccount),
+                               title='SUBACCOUNT {}'.format(subaccount))
+                for subaccount in subaccounts]
+    interval = CONFIG['interval'] / len(monitors)
+    display = asyncio.ensure_future(keep_displaying_accounts(monitors))
+    try:
+        await asyncio.gather(*(watch_account(monitor, i * interval, i % CONFIG['reload_interval'])
+                               for i, monitor in enumerate(monitors)))
+    finally:
+        display.cancel()
+    # The final status once --ticks have run.
+    display_accounts(monitors)
+
+
 def main():
     """Program entry point."""
     opts = parse_args()
     CONFIG['api'] = opts.api or CONFIG['api']
-    CONFIG['headers'] = {'Authorization': 'token ' + opts.token}
+    CONFIG['interval'] = opts.interval
+    CONFIG['ticks'] = opts.ticks
+    CONFIG['metrics_file'] = opts.metrics_file
+    subaccounts = [s.strip() for s in opts.subaccounts.split(',')] if opts.subaccounts else []
+    CONFIG['client'] = UptimeAPI(opts.token, CONFIG['api'], log_file=sys.stdout,
+                                 pool_size=max(1, len(subaccounts)) * CONFIG['fan_out'],
+                                 rate_limits={'read': opts.read_rate} if opts.read_rate else None)
+
+    if subaccounts:
+        asyncio.run(watch_subaccounts(subaccounts))
+        return
 
-    all_checks = []
+    monitor = AccountMonitor(CONFIG['client'])
     minutes_elapsed = 0
-    last_load = dt.datetime.utcnow()
     while True:
-        from_date = last_load
-        last_load = dt.datetime.utcnow()
-
-        if minutes_elapsed % 15 == 0:
-            # Reload the status of all checks every 15 minutes, loading new checks etc.
-            all_checks = load_all_checks()
-        else:
-            # Otherwise check for new alerts and update the checks statuses.
-            new_alerts = load_alerts_from_date(from_date)
-            merge_alerts_into_check_status(all_checks, new_alerts)
+        monitor.tick(minutes_elapsed)
 
         # Show a printout of current status
-        display_check_status(all_checks)
+        monitor.display()
+        write_metrics()
 
-        # Wait for 1 minute which is the minimum interval at which new alerts can be received
-        print('Waiting 1 minute, Ctrl+C to exit...')
-        time.sleep(60)
         minutes_elapsed += 1
+        if CONFIG['ticks'] is not None and minutes_elapsed >= CONFIG['ticks']:
+            break
+
+        # Wait for 1 minute which is the minimum interval at which new alerts can be received
+        print('Waiting {:g} seconds, Ctrl+C to exit...'.format(CONFIG['interval']))
+        time.sleep(CONFIG['interval'])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,111 @@
+"""Page sizes tuned per endpoint, kept between runs.
+
+Every paginated request is timed. The client records the seconds and bytes each item
+took, smoothed over recent pages, and picks the largest page that should still come
+back within TARGET_SECONDS and MAX_PAGE_BYTES. Bigger pages mean fewer requests
+against the rate limits, so light endpoints stay at the server's maximum while heavy
+ones such as `checks/bulk/stats/` shrink until they stop timing out.
+
+The learned sizes are saved to a JSON file (`~/.uptime_page_sizes.json`, or the path
+in the UPTIME_PAGE_SIZES environment variable; set it empty to turn saving off).
+"""
+import atexit
+import json
+import os
+import tempfile
+import threading
+
+DEFAULT_FILE = os.environ.get('UPTIME_PAGE_SIZES',
+                              os.path.join(os.path.expanduser('~'), '.uptime_page_sizes.json'))
+
+# The largest page the API serves, and the smallest page worth asking for.
+MAX_PAGE_SIZE = 250
+MIN_PAGE_SIZE = 10
+
+# A page should take no longer than this, well clear of gateway timeouts...
+TARGET_SECONDS = 5.0
+# ...nor be larger than this.
+MAX_PAGE_BYTES = 4 * 2 ** 20
+
+# Weight of the newest page in the smoothed per-item costs.
+SMOOTHING = 0.3
+# How much a page size may grow after one page.
+MAX_GROWTH = 2.0
+
+
+class PageSizes:
+    """Learned page sizes, keyed by endpoint URL template."""
+
+    def __init__(self, path=DEFAULT_FILE, default=MAX_PAGE_SIZE):
+        self.path = path
+        self.default = default
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.dirty = False
+        if path:
+            self.load()
+            atexit.register(self.save)
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                self.endpoints = json.load(f)
+        except (OSError, ValueError):
+            self.endpoints = {}
+
+    def save(self):
+        """Write the learned sizes, replacing the file atomically."""
+        with self.lock:
+            if not self.path or not self.dirty:
+                return
+            directory = os.path.dirname(os.path.abspath(self.path))
+            try:
+                fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(self.endpoints, f, indent=2, sort_keys=True)
+                os.replace(tmp, self.path)
+                self.dirty = False
+            except OSError:
+                # Tuning is only an optimization; never fail a script over it.
+                pass
+
+    def size(self, endpoint):
+        """The page size to request from an endpoint."""
+        with self.lock:
+            entry = self.endpoints.get(endpoint)
+            return entry['size'] if entry else self.default
+
+    def record(self, endpoint, requested, items, seconds, size_bytes):
+        """Update an endpoint's page size after a page of `items` (of `requested`)
+        took `seconds` and `size_bytes` to download."""
+        # A short last page, or a page too small to be worth tuning for (eg. a probe for
+        # the newest item), is mostly per-request overhead, which says nothing about the
+        # cost of each item.
+        if items <= 0 or items < requested or requested < MIN_PAGE_SIZE:
+            return
+        seconds_per_item = seconds / items
+        bytes_per_item = size_bytes / items
+
+        with self.lock:
+            entry = self.endpoints.setdefault(endpoint, {
+                'size': self.default,
+                'seconds_per_item': seconds_per_item,
+                'bytes_per_item': bytes_per_item,
+            })
+            entry['seconds_per_item'] += SMOOTHING * (seconds_per_item -
+                                                      entry['seconds_per_item'])
+            entry['bytes_per_item'] += SMOOTHING * (bytes_per_item - entry['bytes_per_item'])
+
+            best = min(TARGET_SECONDS / max(entry['seconds_per_item'], 1e-9),
+                       MAX_PAGE_BYTES / max(entry['bytes_per_item'], 1e-9),
+                       entry['size'] * MAX_GROWTH)
+            entry['size'] = int(max(MIN_PAGE_SIZE, min(MAX_PAGE_SIZE, best)))
+            self.dirty = True
+
+    def failed(self, endpoint, requested):
+        """Halve an endpoint's page size after a page timed out on the server."""
+        with self.lock:
+            entry = self.endpoints.setdefault(endpoint, {
+                'size': requested, 'seconds_per_item': 0.0, 'bytes_per_item': 0.0})
+            entry['size'] = max(MIN_PAGE_SIZE, min(entry['size'], requested) // 2)
+            self.dirty = True
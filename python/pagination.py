@@ -0,0 +1,79 @@
+"""Concurrent loading of every page of a list endpoint.
+
+The first page of a listing gives the total `count`, so the number of pages is
+known after one request. `PageFanOut` loads page 1, then pages 2..N a few at a time
+in parallel, and yields them in page order.
+
+Pages are read at slightly different moments, so checks added or deleted while a
+listing is read shift items across page boundaries: an item can then be read twice
+or not at all. `PageFanOut.shifted` is set when the count changes between pages or a
+page disappears. Callers drop duplicates by pk and can read the listing again.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from uptime_api import APIError
+
+# Pages requested at once after the first one.
+DEFAULT_WORKERS = 4
+
+
+def page_count(count, page_size):
+    """The number of pages a listing of `count` items takes."""
+    return max(1, -(-count // page_size))
+
+
+class PageFanOut:
+    """Iterate over every page of a listing, loading pages concurrently.
+
+    load_page(page) must return the page as a dict with the listing's `count` and
+    `next`. With workers=1 the `next` links are followed one page at a time.
+    """
+
+    def __init__(self, load_page, page_size, workers=DEFAULT_WORKERS):
+        self.load_page = load_page
+        self.page_size = page_size
+        self.workers = workers
+        self.count = None
+        self.shifted = False
+
+    def check(self, res):
+        if res['count'] != self.count:
+            self.shifted = True
+
+    def __iter__(self):
+        last = self.load_page(1)
+        self.count = last['count']
+        yield last
+
+        page = 1
+        pages = page_count(self.count, self.page_size)
+        if self.workers > 1 and pages > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                pending = deque()
+                while page < pages or pending:
+                    while page < pages and len(pending) < self.workers:
+                        page += 1
+                        pending.append(pool.submit(self.load_page, page))
+                    try:
+                        last = pending.popleft().result()
+                    except (APIError, requests.HTTPError) as e:
+                        if e.response is None or e.response.status_code != 404:
+                            raise
+                        # The listing got shorter while it was read.
+                        self.shifted = True
+                        for future in pending:
+                            future.cancel()
+                        return
+                    self.check(last)
+                    yield last
+
+        # Follow the links past the pages counted at the start: every page when not
+        # fanning out, otherwise only pages added while the listing was read.
+        while last['next']:
+            page += 1
+            last = self.load_page(page)
+            self.check(last)
+            yield last
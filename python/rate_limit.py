@@ -0,0 +1,151 @@
+"""Adaptive token-bucket rate limiting for the Uptime.com API client.
+
+Each endpoint class (reads, writes, check creation, webhooks) gets its own
+bucket. Buckets start at a conservative rate and creep upwards while requests
+succeed, halve on a 429, and follow the server's `Retry-After` and rate limit
+headers whenever they are present.
+"""
+import email.utils
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+# Endpoint class -> (initial requests/sec, burst size, max requests/sec)
+DEFAULT_RATES = {
+    'read': (2.0, 5, 10.0),
+    'write': (1.0, 2, 10.0),
+    'create': (0.5, 1, 5.0),
+    'webhook': (5.0, 10, 50.0),
+}
+
+# Fraction of the initial rate added after each successful request.
+INCREASE_STEP = 0.05
+MIN_RATE = 0.05
+
+
+def classify(method, url):
+    """Return the endpoint class for a request."""
+    path = urlsplit(url).path
+    if '/webhook/' in path:
+        return 'webhook'
+    if method.upper() in ('GET', 'HEAD', 'OPTIONS'):
+        return 'read'
+    if re.search(r'/checks/add-[\w-]+/$', path):
+        return 'create'
+    return 'write'
+
+
+def parse_retry_after(value, now=None):
+    """Parse a `Retry-After` header into a number of seconds, or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - (now or time.time()))
+
+
+def _header(headers, *names):
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            try:
+                return float(value)
+            except ValueError:
+                return None
+    return None
+
+
+class TokenBucket:
+    """A thread-safe token bucket whose rate adapts to server feedback."""
+
+    def __init__(self, rate, burst=1, max_rate=None):
+        self.initial_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.max_rate = max_rate or rate
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        # While paused `updated` lies in the future, so this drains the bucket and
+        # callers end up waiting out the pause before their own turn.
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Take a token, sleeping until one is available. Returns the seconds waited."""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            # Reserve the token now (possibly going negative) and sleep outside the
+            # lock, so concurrent callers queue up in order without busy-waiting.
+            self.tokens -= 1
+            wait = max(-self.tokens / self.rate, 0.0)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def on_success(self, headers=None):
+        """Record a successful response, speeding up towards the allowed rate."""
+        with self.lock:
+            if headers is not None and self._apply_headers(headers):
+                return
+            self.rate = min(self.max_rate, self.rate + self.initial_rate * INCREASE_STEP)
+
+    def on_throttled(self, headers=None):
+        """Record a 429 response; back off and pause for any `Retry-After`."""
+        with self.lock:
+            self.rate = max(MIN_RATE, self.rate / 2)
+            if headers is not None:
+                self._apply_headers(headers)
+            delay = parse_retry_after(headers.get('Retry-After')) if headers else None
+            if delay is None:
+                delay = 1 / self.rate
+            self._pause(delay)
+            return delay
+
+    def _pause(self, delay):
+        """Hand out no tokens for the next `delay` seconds."""
+        self.tokens = min(self.tokens, 0.0)
+        self.updated = max(self.updated, time.monotonic() + delay)
+
+    def _apply_headers(self, headers):
+        """Follow `X-RateLimit-*`/`RateLimit-*` headers if the server sent them."""
+        remaining = _header(headers, 'X-RateLimit-Remaining', 'RateLimit-Remaining')
+        reset = _header(headers, 'X-RateLimit-Reset', 'RateLimit-Reset')
+        if remaining is None or reset is None:
+            return False
+
+        # The reset is either an epoch timestamp or a number of seconds from now.
+        reset_in = reset - time.time() if reset > 1e9 else reset
+        reset_in = max(reset_in, 0.001)
+        if remaining <= 0:
+            self._pause(reset_in)
+        else:
+            self.rate = min(self.max_rate, max(MIN_RATE, remaining / reset_in))
+        return True
+
+
+class RateLimiter:
+    """A set of token buckets, one per endpoint class."""
+
+    def __init__(self, rates=None):
+        self.buckets = {}
+        for name, (rate, burst, max_rate) in DEFAULT_RATES.items():
+            self.buckets[name] = TokenBucket(rate, burst, max_rate)
+        for name, rate in (rates or {}).items():
+            # Allow either a plain requests/sec number or a full (rate, burst, max) tuple.
+            if isinstance(rate, (int, float)):
+                rate = (rate, max(1, int(rate)), rate)
+            self.buckets[name] = TokenBucket(*rate)
+
+    def bucket(self, method, url):
+        return self.buckets[classify(method, url)]
@@ -0,0 +1,123 @@
+"""Retrying failed API requests, and circuit breakers that stop retry storms.
+
+Requests that fail with a 5xx status, a timeout or a dropped connection are sent
+again after an exponential backoff with full jitter, but only when sending them
+twice is harmless: GET, PUT, DELETE and friends, or a POST/PATCH that never reached
+the server. Other POSTs may already have taken effect, so they are only retried by
+`UptimeAPI.call()` when the caller can check for that (see its `recover` argument).
+
+Each endpoint has a circuit breaker. After FAILURE_THRESHOLD failures in a row it
+opens, and requests to that endpoint fail at once with `CircuitOpenError` instead
+of adding to the load. After RESET_SECONDS one trial request is let through; the
+circuit closes again if it succeeds.
+"""
+import random
+import threading
+import time
+
+import requests
+from urllib3.exceptions import NewConnectionError
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+# Statuses worth sending a request again for.
+RETRY_STATUSES = (500, 502, 503, 504)
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+FAILURE_THRESHOLD = 5
+RESET_SECONDS = 30.0
+
+
+class CircuitOpenError(requests.RequestException):
+    """An endpoint has failed repeatedly, so requests to it are not being sent."""
+
+
+def backoff(attempt):
+    """Seconds to wait before re-sending after the given (0-based) failed attempt."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def never_sent(error):
+    """Whether a request failed before any of it reached the server."""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def can_retry(error, idempotent):
+    """Whether a request that raised `error` may be sent again."""
+    if isinstance(error, CircuitOpenError):
+        return False
+    if not idempotent:
+        return never_sent(error)
+    return isinstance(error, (requests.ConnectionError, requests.Timeout,
+                              requests.exceptions.ChunkedEncodingError))
+
+
+def is_ambiguous(error):
+    """Whether a failed request may or may not have taken effect on the server."""
+    if isinstance(error, CircuitOpenError) or never_sent(error):
+        return False
+    response = getattr(error, 'response', None)
+    if response is not None:
+        return response.status_code >= 500
+    return isinstance(error, (requests.ConnectionError, requests.Timeout,
+                              requests.exceptions.ChunkedEncodingError))
+
+
+class CircuitBreaker:
+    """Tracks the consecutive failures of one endpoint."""
+
+    def __init__(self, threshold=FAILURE_THRESHOLD, reset_seconds=RESET_SECONDS):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+
+    def before(self, endpoint):
+        """Raise CircuitOpenError unless a request may be sent now."""
+        with self.lock:
+            if self.opened_at is None:
+                return
+            now = time.monotonic()
+            if now - self.opened_at >= self.reset_seconds:
+                # Half open: let one request through to see whether the endpoint is back,
+                # holding the others off for another period in case it is not.
+                self.opened_at = now
+                return
+            raise CircuitOpenError('{} failed {} times in a row; not retrying for up to '
+                                   '{:.0f}s'.format(endpoint, self.failures, self.reset_seconds))
+
+    def on_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def on_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+class CircuitBreakers:
+    """One circuit breaker per endpoint template, shared by a client and its
+    subaccount clients."""
+
+    def __init__(self, threshold=FAILURE_THRESHOLD, reset_seconds=RESET_SECONDS):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.lock = threading.Lock()
+        self.breakers = {}
+
+    def get(self, endpoint):
+        with self.lock:
+            breaker = self.breakers.get(endpoint)
+            if breaker is None:
+                breaker = self.breakers[endpoint] = CircuitBreaker(self.threshold,
+                                                                   self.reset_seconds)
+            return breaker
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+import argparse
+import csv
+import itertools
+import sys
+import time
+
+import columnar
+from columnar import np
+
+UNTAGGED = '(no tag)'
+PERCENTILES = (0.5, 0.95, 0.99)
+HEADER = ('group', 'name', 'checks', 'outages', 'downtime_hours', 'uptime', 'below_sla',
+          'response_time', 'p50', 'p95', 'p99')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Roll up check stats downloaded by '
+                                                 'download_check_stats.py into SLA figures '
+                                                 'per tag and per check type.')
+    parser.add_argument('input',
+                        help='Parquet, npz, JSON or ndjson file written by '
+                             'download_check_stats.py')
+    parser.add_argument('--by', choices=['tag', 'check_type', 'both'], default='both',
+                        help='(optional) How to group the checks, default both')
+    parser.add_argument('--sla', type=float, default=99.9,
+                        help='(optional) Uptime percentage each check should meet, '
+                             'default 99.9')
+    parser.add_argument('--include-paused', action='store_true',
+                        help='(optional) Include paused checks, which are left out by default')
+    parser.add_argument('-o', '--output',
+                        help='(optional) CSV file to write the rollup to instead of printing '
+                             'a table')
+
+    return parser.parse_args()
+
+
+def explode_tags(tags):
+    """Return (check index, tag) arrays with one entry for each tag of each check."""
+    split = [t.split(',') for t in tags.tolist()]
+    counts = np.fromiter(map(len, split), dtype=np.int64, count=len(split))
+    rows = np.repeat(np.arange(len(split)), counts)
+    names = np.array(list(itertools.chain.from_iterable(split)), dtype=str)
+    names[names == ''] = UNTAGGED
+    return rows, names
+
+
+def group_percentiles(groups, values, n_groups):
+    """Percentiles of values within each group, interpolated linearly and skipping NaNs.
+    Returns an array of shape (len(PERCENTILES), n_groups)."""
+    keep = ~np.isnan(values)
+    groups, values = groups[keep], values[keep]
+    values = values[np.lexsort((values, groups))]
+    counts = np.bincount(groups, minlength=n_groups)
+    starts = np.cumsum(counts) - counts
+
+    out = np.full((len(PERCENTILES), n_groups), np.nan)
+    has = counts > 0
+    for i, q in enumerate(PERCENTILES):
+        pos = starts[has] + (counts[has] - 1) * q
+        lo = np.floor(pos).astype(np.int64)
+        hi = np.ceil(pos).astype(np.int64)
+        out[i, has] = values[lo] + (values[hi] - values[lo]) * (pos - lo)
+    return out
+
+
+def rollup(columns, rows, keys, sla):
+    """Aggregate the checks at `rows` grouped by `keys` (one key per row). Returns the
+    group names and a dict of per-group arrays."""
+    names, groups = np.unique(keys, return_inverse=True)
+    n = len(names)
+
+    def total(column):
+        return np.bincount(groups, weights=columns[column][rows], minlength=n)
+
+    downtime = total('downtime_secs')
+    monitored = np.bincount(groups, weights=columns['days'][rows] * 86400.0, minlength=n)
+    response_time = columns['response_time'][rows]
+    timed = ~np.isnan(response_time)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result = {
+            'checks': np.bincount(groups, minlength=n),
+            'outages': total('outages'),
+            'downtime_hours': downtime / 3600,
+            'uptime': np.where(monitored > 0, 100 * (1 - downtime / monitored), np.nan),
+            'below_sla': np.bincount(groups, weights=columns['uptime'][rows] < sla,
+                                     minlength=n),
+            'response_time': (np.bincount(groups[timed], weights=response_time[timed],
+                                          minlength=n) /
+                              np.bincount(groups[timed], minlength=n)),
+        }
+    for name, values in zip(('p50', 'p95', 'p99'),
+                            group_percentiles(groups, response_time, n)):
+        result[name] = values
+    return names, result
+
+
+def rollups(columns, by, sla):
+    """Yield (group, name, aggregates) for every group, with the whole fleet first."""
+    checks = np.arange(len(columns['pk']))
+    groupings = [('all', checks, np.full(len(checks), 'all'))]
+    if by in ('check_type', 'both'):
+        groupings.append(('check_type', checks, columns['check_type']))
+    if by in ('tag', 'both'):
+        groupings.append(('tag',) + explode_tags(columns['tags']))
+
+    for group, rows, keys in groupings:
+        if not len(rows):
+            continue
+        names, result = rollup(columns, rows, keys, sla)
+        for i, name in enumerate(names.tolist()):
+            yield group, name, {k: v[i].item() for k, v in result.items()}
+
+
+def format_value(value, fmt):
+    return '-' if value != value else fmt.format(value)
+
+
+def print_table(results, out):
+    out.write('{:10s} {:24s} {:>7} {:>8} {:>10} {:>9} {:>9} {:>8} {:>7} {:>7} {:>7}\n'.format(
+        'group', 'name', 'checks', 'outages', 'down h', 'uptime %', 'below SLA', 'resp s',
+        'p50', 'p95', 'p99'))
+    for group, name, r in results:
+        out.write('{:10s} {:24s} {:>7} {:>8} {:>10} {:>9} {:>9} {:>8} {:>7} {:>7} {:>7}\n'.format(
+            group, name[:24], r['checks'], int(r['outages']),
+            format_value(r['downtime_hours'], '{:.1f}'), format_value(r['uptime'], '{:.3f}'),
+            int(r['below_sla']), format_value(r['response_time'], '{:.3f}'),
+            format_value(r['p50'], '{:.3f}'), format_value(r['p95'], '{:.3f}'),
+            format_value(r['p99'], '{:.3f}')))
+
+
+def main():
+    """Program entry point."""
+    opts = parse_args()
+    started = time.perf_counter()
+    columns = columnar.read_columns(opts.input)
+    loaded = time.perf_counter()
+
+    if not opts.include_paused:
+        active = ~columns['is_paused']
+        columns = {name: values[active] for name, values in columns.items()}
+    results = list(rollups(columns, opts.by, opts.sla))
+    finished = time.perf_counter()
+
+    if opts.output:
+        with open(opts.output, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(HEADER)
+            for group, name, r in results:
+                writer.writerow([group, name] + [r[k] for k in HEADER[2:]])
+    else:
+        print_table(results, sys.stdout)
+
+    sys.stderr.write('Read {} checks in {:.2f}s, rolled up in {:.2f}s.\n'.format(
+        len(columns['pk']), loaded - started, finished - loaded))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""On-disk cache of per-day check statistics for download_check_stats.py.
+
+Stats for a day cannot change once the day is over, so closed days are stored in
+a local SQLite database keyed by check pk and day. Later runs only request the
+days that are missing from the cache or still open, and combine them with the
+cached ones. Totals are rebuilt from the days; fields that cannot be are left out.
+
+The cache relies on each record from `checks/bulk/stats/` carrying a per-day
+`statistics` list (entries with a `date` field). Records without one are passed
+through untouched and never cached.
+"""
+import datetime as dt
+import hashlib
+import json
+import sqlite3
+import threading
+
+SCHEMA_VERSION = 1
+
+# Totals that can be rebuilt by summing the per-day statistics.
+ADDITIVE_FIELDS = ('outages', 'downtime_secs')
+
+# Top-level fields of a stats record that combine() rebuilds or keeps. Any other
+# field, and any total that is neither additive nor `uptime`, only describes the
+# days that were fetched, so it is left out of a combined record.
+RECORD_FIELDS = ('pk', 'statistics', 'alerts', 'totals')
+
+
+def cache_scope(api, token):
+    """Identify an account without storing its token in the cache."""
+    return hashlib.sha256((api + '\0' + token).encode()).hexdigest()[:16]
+
+
+def date_range(start, end):
+    """Yield each day from start to end, inclusive."""
+    day = start
+    while day <= end:
+        yield day
+        day += dt.timedelta(days=1)
+
+
+def split_by_day(stat, start, end):
+    """Split a stats record into {day: data} covering every day from start to end,
+    or return None when the record has no per-day statistics."""
+    statistics = stat.get('statistics')
+    if not isinstance(statistics, list):
+        return None
+
+    days = {day: {'statistics': None, 'alerts': []} for day in date_range(start, end)}
+    for entry in statistics:
+        day = dt.date.fromisoformat(entry['date'][:10])
+        if day in days:
+            days[day]['statistics'] = entry
+    for alert in stat.get('alerts') or []:
+        day = dt.date.fromisoformat(alert['created_at'][:10])
+        if day in days:
+            days[day]['alerts'].append(alert)
+    return days
+
+
+def combine(stat, days, dropped=None, now=None):
+    """Build a stats record from a freshly fetched one plus per-day data from
+    both the cache and the fetch.
+
+    Fields that cannot be rebuilt from the per-day data are left out, and their
+    names (totals as `totals.<name>`) are added to the `dropped` set if one is given.
+    """
+    combined = {key: value for key, value in stat.items() if key in RECORD_FIELDS}
+    if dropped is not None:
+        dropped.update(key for key in stat if key not in RECORD_FIELDS)
+    ordered = [days[day] for day in sorted(days)]
+    combined['statistics'] = [d['statistics'] for d in ordered if d['statistics'] is not None]
+    if 'alerts' in stat:
+        combined['alerts'] = [alert for d in ordered for alert in d['alerts']]
+
+    if isinstance(stat.get('totals'), dict):
+        totals = {}
+        for field in ADDITIVE_FIELDS:
+            if field in stat['totals']:
+                totals[field] = sum(s.get(field) or 0 for s in combined['statistics'])
+        if 'uptime' in stat['totals'] and 'downtime_secs' in totals and days:
+            # Count only the part of today that has passed.
+            now = now or dt.datetime.utcnow()
+            start = dt.datetime.combine(min(days), dt.time())
+            end = min(now, dt.datetime.combine(max(days) + dt.timedelta(days=1), dt.time()))
+            period = (end - start).total_seconds()
+            if period > 0:
+                totals['uptime'] = round(
+                    100.0 * max(0.0, 1 - totals['downtime_secs'] / period), 4)
+        if dropped is not None:
+            dropped.update('totals.' + key for key in stat['totals'] if key not in totals)
+        combined['totals'] = totals
+    return combined
+
+
+class StatsCache:
+    """A SQLite store of per-day stats, safe to share between threads."""
+
+    def __init__(self, path, scope='', grace_days=1):
+        self.scope = scope
+        self.grace_days = grace_days
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            row = self.db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            if row is None or int(row[0]) != SCHEMA_VERSION:
+                self.db.execute('DROP TABLE IF EXISTS days')
+                self.db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)",
+                                (str(SCHEMA_VERSION),))
+            self.db.execute('CREATE TABLE IF NOT EXISTS days ('
+                            'scope TEXT, pk INTEGER, day TEXT, data TEXT, '
+                            'PRIMARY KEY (scope, pk, day)) WITHOUT ROWID')
+
+    def last_closed_day(self):
+        """The latest day whose stats are treated as final."""
+        return dt.datetime.utcnow().date() - dt.timedelta(days=self.grace_days + 1)
+
+    def load(self, pks, from_date):
+        """Return {pk: {day: data}} for every cached closed day since from_date."""
+        cached = {pk: {} for pk in pks}
+        if not pks:
+            return cached
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT pk, day, data FROM days WHERE scope = ? AND day >= ? AND day <= ? '
+                'AND pk IN ({})'.format(','.join('?' * len(pks))),
+                [self.scope, str(from_date), str(self.last_closed_day())] + list(pks)
+            ).fetchall()
+        for pk, day, data in rows:
+            cached[pk][dt.date.fromisoformat(day)] = json.loads(data)
+        return cached
+
+    def first_missing_day(self, cached_days, from_date):
+        """The first day since from_date that must be requested from the API."""
+        for day in date_range(from_date, self.last_closed_day()):
+            if day not in cached_days:
+                return day
+        return max(from_date, self.last_closed_day() + dt.timedelta(days=1))
+
+    def store(self, pk, days):
+        """Save the closed days out of a {day: data} mapping."""
+        last_closed = self.last_closed_day()
+        rows = [(self.scope, pk, str(day), json.dumps(data))
+                for day, data in days.items() if day <= last_closed]
+        if rows:
+            with self.lock, self.db:
+                self.db.executemany('INSERT OR REPLACE INTO days VALUES (?, ?, ?, ?)', rows)
+
+    def invalidate(self, pk=None, since=None):
+        """Forget cached days, optionally only for one check and/or from a given day."""
+        query = 'DELETE FROM days WHERE scope = ?'
+        args = [self.scope]
+        if pk is not None:
+            query += ' AND pk = ?'
+            args.append(pk)
+        if since is not None:
+            query += ' AND day >= ?'
+            args.append(str(since))
+        with self.lock, self.db:
+            self.db.execute(query, args)
+
+    def prune(self, keep_pks):
+        """Forget checks that no longer exist in the account."""
+        keep_pks = set(keep_pks)
+        with self.lock:
+            stored = [pk for (pk,) in self.db.execute(
+                'SELECT DISTINCT pk FROM days WHERE scope = ?', (self.scope,))]
+        for pk in stored:
+            if pk not in keep_pks:
+                self.invalidate(pk)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
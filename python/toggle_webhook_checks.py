@@ -1,8 +1,13 @@
 #!/usr/bin/env python3
+import argparse
 import os
+import queue
+import sys
+import threading
 import time
 
-import requests
+from rate_limit import DEFAULT_RATES
+from uptime_api import UptimeAPI
 
 WEBHOOKS = [
     # NOTE! Set the correct check names & webhook URLs here
@@ -11,6 +16,32 @@ WEBHOOKS = [
 ]
 
 
+# State changes waiting per sending thread, so a large batch is read as it is sent.
+QUEUE_SIZE = 100
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Set the state of webhook checks, '
+                                                 'interactively or in batches.')
+    parser.add_argument('--batch',
+                        help='(optional) Send the state changes listed in this file ("-" for '
+                             'standard input) instead of prompting. Each line holds a webhook '
+                             'URL or a check name from WEBHOOKS, then "up" or "down".')
+    parser.add_argument('--load', type=int,
+                        help='(optional) Send this many state changes, alternating up and '
+                             'down across the WEBHOOKS URLs (or the URLs in --batch), and '
+                             'report the POST latency')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='(optional) Number of state changes to send at once, default 8. '
+                             'Changes to the same URL are always sent in order.')
+    parser.add_argument('--rate', type=float,
+                        help='(optional) Webhook requests per second to allow, default {:g} '
+                             'at first, rising to {:g} while the API keeps up'.format(
+                                 DEFAULT_RATES['webhook'][0], DEFAULT_RATES['webhook'][2]))
+
+    return parser.parse_args()
+
+
 def clear_screen():
     if os.name == 'nt':
         os.system('cls')
@@ -39,12 +70,131 @@ def prompt_for_state():
         return False
 
 
+# Webhook URLs carry their own credentials, so no API token is needed.
+api = UptimeAPI()
+
+
 def call_webhook_api(url, state):
-    r = requests.post(url, json={'state_is_up': state})
+    """Set a webhook check's state and return the seconds the POST took."""
+    # Setting the same state twice is harmless, so failed POSTs can be retried.
+    r = api.request('post', url, json={'state_is_up': state}, idempotent=True)
     r.raise_for_status()
+    # Webhooks need not answer with JSON; when they do, check it for an API error.
+    if r.headers.get('Content-Type', '').startswith('application/json'):
+        api.unwrap(r)
+    # From sending the request to the response arriving, without any rate limit wait.
+    return r.elapsed.total_seconds()
 
 
-def main():
+def parse_state(value):
+    value = value.lower()
+    if value in ('up', 'u', 'true', '1'):
+        return True
+    if value in ('down', 'd', 'false', '0'):
+        return False
+    raise ValueError('state must be up or down, not "{}"'.format(value))
+
+
+def read_changes(lines):
+    """Yield (line number, URL, state) for each state change in the batch."""
+    urls = dict(WEBHOOKS)
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        parts = line.rsplit(None, 1)
+        try:
+            if len(parts) != 2:
+                raise ValueError('expected a webhook URL or check name, then up or down')
+            url = urls.get(parts[0], parts[0])
+            if not url.startswith(('http://', 'https://')):
+                raise ValueError('"{}" is neither a check name in WEBHOOKS nor a webhook '
+                                 'URL'.format(parts[0]))
+            yield number, url, parse_state(parts[1])
+        except ValueError as e:
+            print('Line {}: skipped, {}'.format(number, e))
+
+
+def generate_changes(count, urls):
+    """Yield `count` state changes, cycling through the URLs and flipping each URL's
+    state every time it comes round."""
+    for i in range(count):
+        yield i + 1, urls[i % len(urls)], (i // len(urls)) % 2 == 0
+
+
+class OrderedSender:
+    """Send state changes from several threads over the client's connection pool.
+
+    Every change for a URL goes to the same thread, so the changes to one check are
+    applied in the order they were read while different checks are sent in parallel.
+    """
+
+    def __init__(self, workers):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.failed = 0
+        self.queues = [queue.Queue(maxsize=QUEUE_SIZE) for _ in range(workers)]
+        self.threads = [threading.Thread(target=self.run, args=(q,), daemon=True)
+                        for q in self.queues]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, number, url, state):
+        self.queues[hash(url) % len(self.queues)].put((number, url, state))
+
+    def run(self, changes):
+        while True:
+            change = changes.get()
+            if change is None:
+                return
+            number, url, state = change
+            try:
+                latency = call_webhook_api(url, state)
+            except Exception as e:
+                print('Change {}: FAILED - {}'.format(number, e))
+                with self.lock:
+                    self.failed += 1
+                continue
+            with self.lock:
+                self.latencies.append(latency)
+
+    def close(self):
+        """Wait for every submitted change to be sent."""
+        for q in self.queues:
+            q.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+def percentile(ordered, q):
+    """The nearest-rank percentile of an ascending list."""
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def send_changes(changes, workers):
+    """Send a stream of state changes and print a summary with the POST latency."""
+    sender = OrderedSender(workers)
+    started = time.monotonic()
+    try:
+        for number, url, state in changes:
+            sender.submit(number, url, state)
+    finally:
+        sender.close()
+    elapsed = time.monotonic() - started
+
+    sent = len(sender.latencies)
+    print('\nSent {} state changes ({} failed) in {:.1f}s, {:.1f} changes/s.'.format(
+        sent, sender.failed, elapsed, sent / elapsed if elapsed else 0.0))
+    if sent:
+        latencies = sorted(sender.latencies)
+        print('POST latency: p50 {:.0f} ms, p95 {:.0f} ms, p99 {:.0f} ms, max {:.0f} ms'.format(
+            *(1000 * v for v in (percentile(latencies, 0.5), percentile(latencies, 0.95),
+                                 percentile(latencies, 0.99), latencies[-1]))))
+    if sender.failed:
+        sys.exit(1)
+
+
+def interactive():
     while True:
         clear_screen()
         check = prompt_for_check()
@@ -64,6 +214,34 @@ def main():
         time.sleep(5)
 
 
+def main():
+    """Program entry point."""
+    global api
+    opts = parse_args()
+    if opts.batch is None and opts.load is None:
+        interactive()
+        return
+
+    workers = max(1, opts.workers)
+    api = UptimeAPI(pool_size=workers,
+                    rate_limits={'webhook': opts.rate} if opts.rate else None)
+    source = None
+    if opts.batch:
+        source = sys.stdin if opts.batch == '-' else open(opts.batch)
+    try:
+        if opts.load is None:
+            send_changes(read_changes(source), workers)
+            return
+        if source is not None:
+            urls = list(dict.fromkeys(url for _, url, _ in read_changes(source)))
+        else:
+            urls = [url for _, url in WEBHOOKS]
+        send_changes(generate_changes(opts.load, urls), workers)
+    finally:
+        if source not in (None, sys.stdin):
+            source.close()
+
+
 if __name__ == '__main__':
     try:
         main()
@@ -0,0 +1,245 @@
+"""Shared Uptime.com API client used by the scripts in this directory.
+
+All API traffic goes through a single keep-alive `requests.Session`, so each
+script opens a handful of TCP/TLS connections rather than one per request.
+Requests are paced by an adaptive rate limiter (see `rate_limit.py`) and retried
+behind per-endpoint circuit breakers (see `retry.py`), page sizes are tuned per
+endpoint from how long pages take (see `page_sizes.py`), and every call is
+recorded per endpoint (see `metrics.py`).
+"""
+import time
+from urllib.parse import urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import retry
+from json_decoders import get_decoder, project
+from metrics import Metrics, endpoint_template
+from page_sizes import MIN_PAGE_SIZE, PageSizes
+from rate_limit import RateLimiter
+
+DEFAULT_API = 'https://uptime.com/api/v1/'
+DEFAULT_POOL_SIZE = 10
+
+# How many times a request rejected with a 429 is re-sent before giving up.
+MAX_THROTTLE_RETRIES = 5
+
+# Statuses returned when the server or a gateway gave up on a slow request.
+TIMEOUT_STATUSES = (502, 503, 504)
+
+
+class APIError(Exception):
+    """The API answered with an error in its `messages` envelope."""
+
+    def __init__(self, text, response=None):
+        super().__init__(text)
+        self.response = response
+
+
+class UptimeAPI:
+    """A pooled client for the Uptime.com REST API."""
+
+    def __init__(self, token=None, api=None, subaccount=None,
+                 pool_size=DEFAULT_POOL_SIZE, log_file=None, rate_limits=None,
+                 rate_limiter=None, decoder=None, page_sizes=None, metrics=None,
+                 breakers=None):
+        self.api = api or DEFAULT_API
+        self.loads = get_decoder(decoder)
+        self.log_file = log_file
+        self.rate_limiter = rate_limiter or RateLimiter(rate_limits)
+        self.page_sizes = page_sizes or PageSizes()
+        self.metrics = metrics or Metrics()
+        self.breakers = breakers or retry.CircuitBreakers()
+
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        if token:
+            self.session.headers['Authorization'] = 'token ' + token
+        if subaccount:
+            self.session.headers['X-Subaccount'] = str(subaccount)
+
+    def for_subaccount(self, subaccount):
+        """A client for a subaccount that shares this client's connection pool and
+        rate limits."""
+        client = UptimeAPI(api=self.api, subaccount=subaccount, pool_size=1,
+                           log_file=self.log_file, rate_limiter=self.rate_limiter,
+                           page_sizes=self.page_sizes, metrics=self.metrics,
+                           breakers=self.breakers)
+        client.loads = self.loads
+        client.session.headers['Authorization'] = self.session.headers.get('Authorization')
+        client.adapter = self.adapter
+        client.session.mount('https://', self.adapter)
+        client.session.mount('http://', self.adapter)
+        return client
+
+    def url(self, endpoint, pk=None):
+        """Build the full URL for an endpoint; absolute URLs are passed through."""
+        if endpoint.startswith(('http://', 'https://')):
+            return endpoint
+        return self.api + endpoint.format(pk=pk)
+
+    def page_size(self, endpoint):
+        """The page size to request from an endpoint, as learned from earlier pages.
+
+        Read it once per listing: page numbers only line up while the size is fixed.
+        """
+        return self.page_sizes.size(self.url(endpoint, pk='{pk}'))
+
+    def log(self, label, method, url, params=None):
+        if self.log_file is None or label is None:
+            return
+        qs = '?' + urlencode(params) if params else ''
+        self.log_file.write('{} - {} {}{}\n'.format(label, method.upper(), url, qs))
+
+    def send(self, method, url, template, params=None, json=None, headers=None, retried=False):
+        """Send a request once, re-sending only while it is throttled (a throttled
+        request was never processed, so that is safe even when it is not idempotent).
+        Returns the response and the seconds the final attempt took."""
+        bucket = self.rate_limiter.bucket(method, url)
+        waited = 0.0
+        bytes_out = 0
+        for attempt in range(MAX_THROTTLE_RETRIES):
+            waited += bucket.acquire()
+            resends = attempt + retried
+            started = time.perf_counter()
+            try:
+                r = self.session.request(method, url, params=params, json=json,
+                                         headers=headers)
+            except requests.RequestException as e:
+                self.metrics.record(method, template, type(e).__name__,
+                                    time.perf_counter() - started, waited, resends)
+                raise
+            elapsed = time.perf_counter() - started
+            bytes_out += len(r.request.body or b'')
+            if r.status_code != 429:
+                # A failing server is no reason to speed up.
+                if r.status_code < 500:
+                    bucket.on_success(r.headers)
+                break
+            delay = bucket.on_throttled(r.headers)
+            if self.log_file is not None:
+                self.log_file.write('Rate limited, retrying in {:.1f}s\n'.format(delay))
+        self.metrics.record(method, template, r.status_code, elapsed, waited, resends,
+                            bytes_out, len(r.content))
+        return r, elapsed
+
+    def request(self, method, endpoint, pk=None, params=None, json=None, label=None,
+                headers=None, page_size=None, idempotent=None):
+        """Send a request and return the raw response.
+
+        Failures are retried with a jittered exponential backoff (see `retry.py`) when
+        the request is idempotent, which by default depends on its method.
+
+        Requests for a page of results are timed for the page size tuning, unless the
+        page is smaller than any tuned size, like a request for just the newest item.
+        Pass page_size for a batch that is not sized by a `page_size` param, eg. the
+        number of pks sent to a bulk endpoint.
+        """
+        url = self.url(endpoint, pk)
+        self.log(label, method, url, params)
+        if idempotent is None:
+            idempotent = method.upper() in retry.IDEMPOTENT_METHODS
+
+        template = endpoint_template(url, self.api)
+        breaker = self.breakers.get(template)
+        for attempt in range(retry.MAX_RETRIES + 1):
+            breaker.before(template)
+            try:
+                r, elapsed = self.send(method, url, template, params=params, json=json,
+                                       headers=headers, retried=attempt > 0)
+            except requests.RequestException as e:
+                breaker.on_failure()
+                if attempt == retry.MAX_RETRIES or not retry.can_retry(e, idempotent):
+                    raise
+                reason = type(e).__name__
+            else:
+                if r.status_code < 500:
+                    breaker.on_success()
+                    break
+                breaker.on_failure()
+                if (attempt == retry.MAX_RETRIES or not idempotent or
+                        r.status_code not in retry.RETRY_STATUSES):
+                    break
+                reason = 'HTTP {}'.format(r.status_code)
+
+            delay = retry.backoff(attempt)
+            if self.log_file is not None:
+                self.log_file.write('{} from {} {}, retrying in {:.1f}s\n'.format(
+                    reason, method.upper(), url, delay))
+            time.sleep(delay)
+
+        if page_size is None and params and 'page_size' in params:
+            page_size = int(params['page_size'])
+        if page_size and page_size >= MIN_PAGE_SIZE:
+            key = self.url(endpoint, pk='{pk}')
+            if r.status_code in TIMEOUT_STATUSES:
+                self.page_sizes.failed(key, page_size)
+            # Recorded in unwrap(), once the number of items on the page is known.
+            r.page_timing = (key, page_size, elapsed)
+        return r
+
+    def unwrap(self, r, fields=None):
+        """Decode a response, raising on errors and unwrapping the `messages` envelope.
+
+        If fields are given, each item of a list response's `results` is cut down to them.
+        """
+        try:
+            res = self.loads(r.content) if r.content else None
+        except ValueError:
+            # Not JSON, eg. an error page from a proxy.
+            r.raise_for_status()
+            raise
+        if fields is not None:
+            res = project(res, fields)
+        timing = getattr(r, 'page_timing', None)
+        if timing and r.ok and isinstance(res, dict) and isinstance(res.get('results'), list):
+            key, requested, elapsed = timing
+            self.page_sizes.record(key, requested, len(res['results']), elapsed, len(r.content))
+        if isinstance(res, dict) and 'messages' in res:
+            msg = res['messages']
+            if msg.get('errors'):
+                text = '%s: %s' % (msg.get('error_code'), msg.get('error_message'))
+                if msg.get('error_fields'):
+                    text += ' Field errors: '
+                    for k, v in msg['error_fields'].items():
+                        text += '%s: %s' % (k, v)
+                raise APIError(text, response=r)
+            r.raise_for_status()
+            return res.get('results')
+        r.raise_for_status()
+        return res
+
+    def call(self, method, endpoint, pk=None, params=None, json=None, label=None,
+             headers=None, fields=None, idempotent=None, recover=None):
+        """Make an API call and return its decoded result.
+
+        A non-idempotent call that fails in a way that leaves it unknown whether it took
+        effect (a 5xx or a dropped connection) is only retried when `recover` is given:
+        a function that returns the result of an earlier attempt that did take effect,
+        eg. by looking up a check that was being created, or None if there was none.
+        """
+        for attempt in range(retry.MAX_RETRIES + 1):
+            try:
+                return self.unwrap(self.request(method, endpoint, pk=pk, params=params,
+                                                json=json, label=label, headers=headers,
+                                                idempotent=idempotent),
+                                   fields=fields)
+            except (APIError, requests.RequestException) as e:
+                if (recover is None or attempt == retry.MAX_RETRIES or
+                        not retry.is_ambiguous(e)):
+                    raise
+                error = e
+            result = recover()
+            if result is not None:
+                return result
+            delay = retry.backoff(attempt)
+            if self.log_file is not None:
+                self.log_file.write('{} did not take effect ({}), retrying in {:.1f}s\n'.format(
+                    label or endpoint, error, delay))
+            time.sleep(delay)
+
+    def close(self):
+        self.session.close()